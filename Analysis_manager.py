@@ -1,4 +1,5 @@
 from functools import lru_cache
+import numpy as np
 
 class PhysicsCalculator:
     def __init__(self):
@@ -47,35 +48,47 @@ class PhysicsCalculator:
     def get_net_force(self, vel_v=None, mass=None, acc_v=None):
         return self.get_net_acc(vel_v=None, mass=None, acc_v=acc_v) * mass
 
+class _Components:
+    # x, y and z columns of a (..., 3) array, in place of a vector
+    def __init__(self, array):
+        self.x, self.y, self.z = array[..., 0], array[..., 1], array[..., 2]
+
+
 class Analysis_manager(PhysicsCalculator):
     def __init__(self, SimulationState_obj):
         super(Analysis_manager, self).__init__()
         # Initialize simulation parameters from state object
         self.run_time = SimulationState_obj.sim_duration  # Total simulation time
         self.increment = SimulationState_obj.sim_increment  # Time step size
+        self.output_interval = SimulationState_obj.output_interval  # Time between recorded frames
+        self.output_stride = SimulationState_obj.output_stride  # Integration steps per recorded frame
         self.masses = [par["Mass"] for par in SimulationState_obj.initial_conditions]
         self.pos_data = SimulationState_obj.pos_data  # Position history
         self.vel_data = SimulationState_obj.vel_data  # Velocity history
         self.acc_data = SimulationState_obj.acc_data  # Acceleration history
+        self.store = SimulationState_obj  # Source of the (frames, N, 3) channels behind them
+        self.collision_log = SimulationState_obj.collision_log  # Collision events
 
     # Process particle data for specified physical quantity
-    def process_data(self, var_name):
-        result_data = []
+    def process_data(self, var_name, chunk_frames=4096):
         calculation_func = self.var_to_func[var_name]
-        
+        vel, acc = self.store.channel("vel"), self.store.channel("acc")
+        lengths = np.minimum(vel.lengths, acc.lengths)
+        frames = int(lengths.max(initial=0))
+        masses = np.array(self.masses, dtype=float)
+
+        # Work through the frames a block at a time, so memory-mapped trajectories are read page by page;
+        # the calculation functions only use .x/.y/.z, so they run on whole blocks unchanged
+        values = np.empty((frames, len(masses)))
+        for start in range(0, frames, chunk_frames):
+            stop = min(start + chunk_frames, frames)
+            values[start:stop] = calculation_func(_Components(vel.block(start, stop)), masses,
+                                                  _Components(acc.block(start, stop)))
+
         # Calculate values for each particle over time
-        for part_id in range(len(self.masses)):
-            particle_history = []
-            for time_step in range(len(self.vel_data[part_id])):
-                # Calculate physics value for this time step
-                value = calculation_func(
-                    self.vel_data[part_id][time_step],
-                    self.masses[part_id],
-                    self.acc_data[part_id][time_step]
-                )
-                particle_history.append((time_step * self.increment, value))
-            result_data.append(particle_history)
-        return result_data
+        times = (np.arange(frames) * self.output_interval).tolist()
+        return [list(zip(times[:lengths[part_id]], values[:lengths[part_id], part_id].tolist()))
+                for part_id in range(len(masses))]
 
     # Merge sort implementation for finding extreme values
     def m_sort(self, arr):
@@ -120,4 +133,40 @@ class Analysis_manager(PhysicsCalculator):
             extremes["Minimum"].append(particle_data[0])   # First element after sort
             extremes["Maximum"].append(particle_data[-1])  # Last element after sort
         
-        return extremes
\ No newline at end of file
+        return extremes
+
+    # Collision events as columns, optionally only those involving one particle or in a recorded frame range.
+    # The log holds integration steps; "frame" is the recorded frame at or before each collision
+    def collision_events(self, particle=None, first_frame=0, last_frame=None):
+        log = self.collision_log
+        frames = log.column("step") // self.output_stride
+        mask = frames >= first_frame
+        if last_frame is not None:
+            mask &= frames <= last_frame
+        if particle is not None:
+            mask &= (log.column("first") == particle) | (log.column("second") == particle)
+
+        events = {name: log.column(name)[mask] for name in log.COLUMNS}
+        events["frame"] = frames[mask]
+        events["time"] = events["step"] * self.increment
+        return events
+
+    # Summary of every collision in the run
+    def collision_statistics(self):
+        log = self.collision_log
+        if len(log) == 0:
+            return {"Count": 0, "Per_Particle": [0] * len(self.masses)}
+
+        speeds = log.column("relative_speed")
+        impulses = log.column("impulse")
+        per_particle = np.bincount(log.column("first"), minlength=len(self.masses)) \
+            + np.bincount(log.column("second"), minlength=len(self.masses))
+        return {
+            "Count": len(log),
+            "Per_Particle": per_particle.tolist(),
+            "First_Time": float(log.column("step").min() * self.increment),
+            "Mean_Relative_Speed": float(speeds.mean()),
+            "Max_Relative_Speed": float(speeds.max()),
+            "Mean_Impulse": float(impulses.mean()),
+            "Max_Impulse": float(impulses.max()),
+        }
@@ -1,13 +1,25 @@
-from vpython import vector, cross, proj
-from Particle_manager import Particle
+from vpython import vector, dot, norm
+from Particle_manager import Particle, Collision_Log
+from Neighbour_manager import Sweep_And_Prune, cell_pairs
+import numpy as np
 
 class Collision_manager:
-    def __init__(self, particleGroupObj, e):
+    def __init__(self, particleGroupObj, e, broad_phase="hash", collision_log=None):
         # Initialize collision system with particle group and restitution coefficient
         self.particles = particleGroupObj  # Particle group to manage
         self.e = e  # Coefficient of restitution (1 = perfectly elastic)
-        self.hasJustCollided = self._setupCollisionCounter()  # Collision state tracker
+        # Pairs currently in contact, as packed i * N + j keys of their particle indices (i < j)
+        self.contacts = set()
         self.bounces = 0  # Total collision count
+        self.collision_log = collision_log if collision_log is not None else Collision_Log()
+        self.step = 0  # Integration step written to the collision log
+
+        # "hash" uses the particle group's spatial hash, "sweep" an incremental sweep-and-prune
+        if broad_phase not in ("hash", "sweep"):
+            raise ValueError(f"Unknown collision broad phase: {broad_phase}")
+        self.broad_phase = broad_phase
+        self.sweep = Sweep_And_Prune() if broad_phase == "sweep" else None
+        self.sweep_keys = np.empty(0, dtype=int)  # Sorted packed keys of the pairs whose boxes overlap
 
     def neutron_creation(self, p1, p2):
         # Special nuclear reaction case: convert collision into neutron
@@ -15,66 +27,167 @@ class Collision_manager:
         # Transform first particle into neutron properties
         p1.charge, p1.mass, p1.colour = [0, 100, vector(0,1,0)]
 
-    def _setupCollisionCounter(self):
-        # Initialize collision tracking for all particle pairs
-        collision_state = {}
-        for pair in self.particles.particle_pairs:
-            collision_state[pair] = False  # Start with no active collisions
-        return collision_state
-
     def collisionDetection(self):
-        # Main collision checking loop for all particle pairs
-        for pa, pb in self.particles.particle_pairs:
-            if pa.does_collide_with(pb):
-                # Prevent duplicate collision handling
-                if self.hasJustCollided[(pa, pb)]:
-                    continue
-                # Handle collision and update state
-                self.collide(pa, pb)
-                self.hasJustCollided[(pa, pb)] = True
-                self.bounces += 1  # Increment global bounce counter
-            else:
-                # Reset collision state when particles separate
-                if self.hasJustCollided[(pa,pb)]:
-                    self.hasJustCollided[(pa,pb)] = False
+        # Narrow phase over the broad-phase candidate index pairs
+        pairs = self._sweep_pairs() if self.sweep is not None else self.particles.collision_pairs()
+        pos = self.particles.positions()
+        radius = self.particles.radii()
+        i, j = pairs[:, 0], pairs[:, 1]
+        d = pos[j] - pos[i]
+        touching = np.einsum("ij,ij->i", d, d) < (radius[i] + radius[j])**2
+
+        # Sorted keys keep the original pair order; pairs already in contact were handled when they first touched
+        keys = np.unique(i[touching] * self.particles.array_size + j[touching]).tolist()
+        new_contacts = [key for key in keys if key not in self.contacts]
+        self.contacts = set(keys)  # Pairs that have separated drop out
+        self.bounces += len(new_contacts)  # Increment global bounce counter
+        self.resolve_contacts(new_contacts)
+
+    def _sweep_pairs(self):
+        # Pairs whose bounding boxes overlap. The candidate keys only change with the sweep-and-prune
+        # add/remove events, so nothing is rebuilt on frames where no box starts or stops overlapping
+        sources = self.particles.source_indices()
+        added, removed = self.sweep.update(self.particles.positions()[sources], self.particles.radii()[sources])
+        n = self.particles.array_size
+        if added or removed:
+            added, removed = (sources[np.array(pairs, dtype=int).reshape(-1, 2)] for pairs in (added, removed))
+            removed = removed[:, 0] * n + removed[:, 1]
+            self.sweep_keys = np.union1d(np.setdiff1d(self.sweep_keys, removed), added[:, 0] * n + added[:, 1])
+            # Separated boxes can't hold touching spheres
+            self.contacts.difference_update(removed.tolist())
+        return np.stack([self.sweep_keys // n, self.sweep_keys % n], axis=1)
+
+    def continuous_collisions(self, start, dt, max_impacts=1000):
+        """Swept-sphere collision pass over the step just taken from the start positions.
+
+        Each particle is taken to move in a straight line from start to its new
+        position. Impacts are found in time order from the time of impact of each
+        approaching pair: all particles are moved to that time, the pair is
+        resolved at contact with resolve_contacts(), and the rest of the step continues
+        with the new velocities. Pairs already overlapping at the start are left to
+        collisionDetection. Returns True if any velocities changed.
+        """
+        particles = self.particles.array_particles
+        sources = np.array([i for i, p in enumerate(particles) if not p.is_test_particle], dtype=int)
+        if len(sources) < 2:
+            return False
+        pos = start[sources].copy()
+        vel = self.particles.velocities()[sources].copy()
+        step = self.particles.positions()[sources] - pos  # Displacement over the rest of the step
+        radius = np.array([particles[i].radius for i in sources], dtype=float)
+        remaining = 1.0  # Fraction of the step still to go
+        impacts = 0
+
+        while impacts < max_impacts:
+            # Any pair that can touch before the end of the step shares or neighbours a cell around its path midpoint
+            reach = 2 * radius.max() + np.sqrt(np.einsum("ij,ij->i", step, step)).max()
+            if reach <= 0:
+                break
+            i, j = cell_pairs(pos + step / 2, reach).T
+            d = pos[j] - pos[i]
+            w = step[j] - step[i]
+            a = np.einsum("ij,ij->i", w, w)
+            b = 2 * np.einsum("ij,ij->i", d, w)
+            c = np.einsum("ij,ij->i", d, d) - (radius[i] + radius[j])**2
+            disc = b**2 - 4 * a * c
+            approaching = (c > 0) & (b < 0) & (disc >= 0)
+            if not approaching.any():
+                break
+            with np.errstate(divide="ignore", invalid="ignore"):
+                toi = np.where(approaching, (-b - np.sqrt(np.where(approaching, disc, 0))) / (2 * a), np.inf)
+            first = np.argmin(toi)
+            tau = toi[first]
+            if not tau <= 1.0:
+                break
+
+            # Advance everything to the contact time and resolve the pair there
+            pos += step * tau
+            step *= 1 - tau
+            remaining *= 1 - tau
+            pair = np.array([i[first], j[first]])
+            key = sources[pair[0]] * len(particles) + sources[pair[1]]
+            self.particles.set_motion(pos[pair], vel[pair], sources[pair])
+            self.resolve_contacts([key])
+            vel[pair] = self.particles.velocities()[sources[pair]]
+            step[pair] = vel[pair] * dt * remaining
+
+            self.contacts.add(key)
+            self.bounces += 1
+            impacts += 1
+
+        if impacts == 0:
+            return False
+        all_pos = self.particles.positions().copy()
+        all_vel = self.particles.velocities().copy()
+        all_pos[sources] = pos + step
+        all_vel[sources] = vel
+        self.particles.set_motion(all_pos, all_vel)
+        return True
+
+    def resolve_contacts(self, contacts):
+        """Batched collide() for a frame's contact keys, with the same result as resolving them one by one in order.
+
+        Each approaching pair gets the restitution impulse along its contact normal n
+        (from the first particle to the second):
+            j = (1 + e) (v1 - v2).n / (1/m1 + 1/m2),  v1' = v1 - j n / m1,  v2' = v2 + j n / m2
+        which leaves the tangential velocities alone and conserves momentum, and
+        energy when e = 1. Contacts are split into rounds in which no particle
+        appears twice, and each round is one array update. A particle's contacts
+        fall into successive rounds in their original order.
+        """
+        if not contacts:
+            return
+        contacts = np.asarray(contacts)
+        n = self.particles.array_size
+        involved, slots = np.unique(np.stack([contacts // n, contacts % n]), return_inverse=True)
+        first, second = slots.reshape(2, -1)
+        # Only the particles in contact are read and written, straight from the group's arrays
+        pos = self.particles.positions()[involved]
+        vel = self.particles.velocities()[involved]
+        mass = np.array([self.particles.array_particles[i].mass for i in involved], dtype=float)
+        normal = pos[second] - pos[first]
+        normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+        relative_speed = np.empty(len(contacts))
+        impulse = np.empty(len(contacts))
+
+        # Each contact goes in the round after the last one either of its particles was in
+        last_round = np.full(len(involved), -1)
+        rounds = np.empty(len(contacts), dtype=int)
+        for k, (a, b) in enumerate(zip(first, second)):
+            rounds[k] = max(last_round[a], last_round[b]) + 1
+            last_round[a] = last_round[b] = rounds[k]
+
+        inv_mass = 1 / mass
+        for r in range(rounds.max() + 1):
+            in_round = rounds == r
+            a = first[in_round]
+            b = second[in_round]
+            n = normal[in_round]
+            closing = np.einsum("ij,ij->i", vel[a] - vel[b], n)
+            # Pairs already moving apart, e.g. after an earlier contact this frame, are left as they are
+            j = (1 + self.e) * np.maximum(closing, 0.0) / (inv_mass[a] + inv_mass[b])
+            vel[a] -= (j * inv_mass[a])[:, np.newaxis] * n
+            vel[b] += (j * inv_mass[b])[:, np.newaxis] * n
+            relative_speed[in_round] = closing
+            impulse[in_round] = j
+
+        self.particles.set_motion(pos, vel, involved)
+        self.collision_log.record(self.step, involved[first], involved[second], normal, relative_speed, impulse)
 
     def collide(self, p1, p2):
-        # Calculate collision response using momentum conservation
-        rOriginal = p2.pos - p1.pos  # Vector between particle centers
-        
+        """Scalar reference for resolve_contacts(): the restitution impulse for a single pair.
+
+        The simulation itself only calls resolve_contacts(); this is kept to check
+        the batched update against.
+        """
         # Uncomment for special neutron creation logic
         # if self.bounces >= 2:
         #     self.neutron_creation(p1,p2)
 
-        # Create local coordinate system for collision
-        rHorzPerp = cross(rOriginal, vector(0,1,0))  # Horizontal perpendicular
-        rVertPerp = cross(rHorzPerp, rOriginal)       # Vertical perpendicular
-
-        # Decompose velocities into collision coordinate system components
-        p1VelocitiesIJK = [
-            proj(p1.velocity, rOriginal),   # Along collision axis
-            proj(p1.velocity, rVertPerp),   # Vertical component
-            proj(p1.velocity, rHorzPerp)    # Horizontal component
-        ]
-        p2VelocitiesIJK = [
-            proj(p2.velocity, rOriginal),
-            proj(p2.velocity, rVertPerp),
-            proj(p2.velocity, rHorzPerp)
-        ]
-
-        # Process each velocity component separately
-        for i in range(len(p1VelocitiesIJK)):
-            # Store initial velocity for calculation
-            p1InitialVelocity = p1VelocitiesIJK[i]
-            
-            # Conservation of momentum with restitution coefficient
-            # Formula: v1' = [(m1 - e*m2)v1 + (1+e)m2v2] / (m1 + m2)
-            p1VelocitiesIJK[i] = (1.15 * p1VelocitiesIJK[i] * (p1.mass - p2.mass * self.e)
-                            + p2.mass * p2VelocitiesIJK[i] * (1 + self.e)) / (p1.mass + p2.mass)
-            
-            # Corresponding momentum transfer for second particle
-            p2VelocitiesIJK[i] = (1.15 * p1InitialVelocity - p2VelocitiesIJK[i]) * self.e + p1VelocitiesIJK[i]
-
-            # Reconstruct velocity vectors from components
-            p1.velocity = sum(p1VelocitiesIJK)
-            p2.velocity = sum(p2VelocitiesIJK)
\ No newline at end of file
+        normal = norm(p2.pos - p1.pos)  # Contact normal, from p1 to p2
+        closing = dot(p1.velocity - p2.velocity, normal)
+        if closing <= 0:
+            return  # Already separating
+        impulse = (1 + self.e) * closing / (1 / p1.mass + 1 / p2.mass)
+        p1.velocity = p1.velocity - impulse / p1.mass * normal
+        p2.velocity = p2.velocity + impulse / p2.mass * normal
@@ -1,7 +1,9 @@
 import sqlite3
 import os.path
 from Particle_manager import *
+from Storage_manager import decode_payload
 import json
+import numpy as np
 import bcrypt
 
 class File_Manager():
@@ -24,10 +26,14 @@ class File_Manager():
             "Rate": SimulationState_obj.sim_rate,
             "Increment": SimulationState_obj.sim_increment,
             "Duration": SimulationState_obj.sim_duration,
+            "Integrator": SimulationState_obj.integrator,
+            "Output_Stride": SimulationState_obj.output_stride,
             "Particles": SimulationState_obj.initial_conditions,  # Particle configurations
-            "Pos_Data": self._arrv_to_a(SimulationState_obj.pos_data),  # Position history
-            "Vel_Data": self._arrv_to_a(SimulationState_obj.vel_data),  # Velocity history
-            "Acc_Data": self._arrv_to_a(SimulationState_obj.acc_data)   # Acceleration history
+            "Encoding": SimulationState_obj.encoding,
+            "Pos_Data": SimulationState_obj.encoded_channel("pos"),  # Position history
+            "Vel_Data": SimulationState_obj.encoded_channel("vel"),  # Velocity history
+            "Acc_Data": SimulationState_obj.encoded_channel("acc"),  # Acceleration history
+            "Collisions": SimulationState_obj.collision_log.to_dict()   # Collision event log
         }
 
         # Convert vector objects to lists for JSON serialization
@@ -50,7 +56,8 @@ class File_Manager():
                 initial_velocity=self.a_to_v(dct["Velocity"]),
                 initial_acceleration=self.a_to_v(dct["Acceleration"]),
                 radius=dct["Radius"],
-                colour=self.a_to_v(dct["Colour"])
+                colour=self.a_to_v(dct["Colour"]),
+                is_test_particle=dct.get("Test_Particle", False)
             )
             particles.append(particle)
         
@@ -61,12 +68,16 @@ class File_Manager():
             jsd["Sim_Name"],
             jsd["Rate"],
             jsd["Increment"],
-            jsd["Duration"]
+            jsd["Duration"],
+            jsd.get("Integrator", "euler")  # Files saved before integrators were selectable
         )
+        ds.set_output_stride(jsd.get("Output_Stride", 1))
         # Restore vector data from serialized arrays
         ds.pos_data = self._arr_arrv(jsd["Pos_Data"])
         ds.vel_data = self._arr_arrv(jsd["Vel_Data"])
         ds.acc_data = self._arr_arrv(jsd["Acc_Data"])
+        if "Collisions" in jsd:  # Files saved before collisions were logged have none
+            ds.collision_log = Collision_Log.from_dict(jsd["Collisions"])
         return ds
 
     # Convert vector to 3-element list
@@ -79,6 +90,8 @@ class File_Manager():
 
     # Convert array of vectors to 2D array of lists
     def _arrv_to_a(self, vectarr):
+        if hasattr(vectarr, "tolist"):  # Array-backed trajectories convert in one go
+            return vectarr.tolist()
         result = []
         for particle in vectarr:
             p_arr = []
@@ -91,6 +104,9 @@ class File_Manager():
     def _arr_arrv(self, arr):
         result = []
         for particle in arr:
+            if isinstance(particle, dict):  # Encoded payload, decoded straight to an array
+                result.append(decode_payload(particle))
+                continue
             p_arr = []
             for data in particle:
                 p_arr.append(self.a_to_v(data))
@@ -163,12 +179,19 @@ class Database_manager():
         self.pos_data_raw = SimulationState_obj.pos_data  # Position history
         self.vel_data_raw = SimulationState_obj.vel_data  # Velocity history
         self.acc_data_raw = SimulationState_obj.acc_data  # Acceleration history
+        self.trajectories = [SimulationState_obj.channel(channel) for channel in ("pos", "vel", "acc")]
+        self.encoding = SimulationState_obj.encoding  # Encoding the trajectories are saved with
+        self.encoded_data = None if self.encoding in ("float64", "float32") else \
+            [SimulationState_obj.encoded_channel(channel) for channel in ("pos", "vel", "acc")]
         self.par_data = SimulationState_obj.initial_conditions  # Particle configs
+        self.collision_log = SimulationState_obj.collision_log  # Collision events
         self.sim_data = {"Rate" : SimulationState_obj.sim_rate, 
                         "Run Time" : SimulationState_obj.sim_duration,
                         "Increment" : SimulationState_obj.sim_increment, 
                         "Sim_Name" : SimulationState_obj.sim_name,
-                        "No_Pars" : len(self.par_data)}  # Simulation metadata
+                        "No_Pars" : len(self.par_data),
+                        "Integrator" : SimulationState_obj.integrator,
+                        "Output_Stride" : SimulationState_obj.output_stride}  # Simulation metadata
         
     # Reconstruct SimulationState from database data
     def eject_store(self):
@@ -176,10 +199,13 @@ class Database_manager():
         new_store.build(self.sim_data["Sim_Name"], 
                         self.sim_data["Rate"],
                         self.sim_data["Increment"], 
-                        self.sim_data["Run Time"])
+                        self.sim_data["Run Time"],
+                        self.sim_data.get("Integrator"))
+        new_store.set_output_stride(self.sim_data.get("Output_Stride", 1))
         new_store.set_pos_data(self.pos_data_raw)
         new_store.set_vel_data(self.vel_data_raw)
         new_store.set_acc_data(self.acc_data_raw)
+        new_store.collision_log = self.collision_log
         return new_store
 
     # Check if simulation name exists in database
@@ -230,6 +256,10 @@ class Database_manager():
         self.sim_data = {"Rate": sim_data_raw[0][2], "Run Time": sim_data_raw[0][3],
                         "Increment": sim_data_raw[0][4], "Sim_Name": sim_data_raw[0][0],
                         "No_Pars": sim_data_raw[0][1]}
+        cmd = "SELECT Integrator, OutputStride FROM Simulations WHERE Sim_Name = ?"
+        integrator, output_stride = cursor.execute(cmd, (sim_name,)).fetchone()
+        self.sim_data["Integrator"] = integrator or "euler"
+        self.sim_data["Output_Stride"] = output_stride or 1
 
         # Retrieve particle configurations
         cmd = "SELECT * FROM Particles WHERE Sim_Name = '{}'".format(sim_name)
@@ -241,29 +271,35 @@ class Database_manager():
             "Velocity": self._text_to_vec(p[5]),
             "Acceleration": self._text_to_vec(p[6]),
             "Radius": p[7],
-            "Colour": self._text_to_vec(p[8])} for p in par_data_raw
+            "Colour": self._text_to_vec(p[8]),
+            "Test_Particle": bool(p[9])} for p in par_data_raw
         ]
 
-        # Retrieve trajectory data
-        par_ID_start = par_data_raw[0][0]
-        cmd = "SELECT Pos_Data FROM Particles_Data WHERE ParticleID >= {}".format(par_ID_start)
-        pos_d_raw = list(cursor.execute(cmd))
-        self.pos_data_raw = self._txt_to_arr(pos_d_raw)
-
-        cmd = "SELECT Vel_Data FROM Particles_Data WHERE ParticleID >= {}".format(par_ID_start)
-        vel_d_raw = list(cursor.execute(cmd))
-        self.vel_data_raw = self._txt_to_arr(vel_d_raw)
-
-        cmd = "SELECT Acc_Data FROM Particles_Data WHERE ParticleID >= {}".format(par_ID_start)
-        acc_d_raw = list(cursor.execute(cmd))
-        self.acc_data_raw = self._txt_to_arr(acc_d_raw)
+        # Retrieve collision events
+        cmd = """SELECT Step, First, Second, NormalX, NormalY, NormalZ, RelativeSpeed, Impulse
+                 FROM Collisions WHERE Sim_Name = ? ORDER BY EventID"""
+        rows = cursor.execute(cmd, (sim_name,)).fetchall()
+        self.collision_log = Collision_Log.from_dict({
+            "step": [row[0] for row in rows], "first": [row[1] for row in rows],
+            "second": [row[2] for row in rows], "normal": [row[3:6] for row in rows],
+            "relative_speed": [row[6] for row in rows], "impulse": [row[7] for row in rows]})
+
+        # Retrieve trajectory data, one row per particle of this simulation
+        cmd = """SELECT Pos_Data, Vel_Data, Acc_Data, Pos_Blob, Vel_Blob, Acc_Blob, DataType
+                 FROM Particles_Data WHERE ParticleID IN (SELECT ParticleID FROM Particles WHERE Sim_Name = ?)
+                 ORDER BY ParticleID"""
+        rows = cursor.execute(cmd, (sim_name,)).fetchall()
+        self.pos_data_raw, self.vel_data_raw, self.acc_data_raw = (
+            [self._blob_to_arr(row[3 + c], row[6]) if row[3 + c] is not None else self._txt_to_arr([row[c:c + 1]])[0]
+             for row in rows] for c in range(3))
+        connection.close()
         
         # Rebuild particle objects
         for data in self.par_data:
             self.particle_lst.append(Particle(data["Charge"], data["Mass"],
                                     data["Position"], data["Velocity"],
                                     data["Acceleration"], data["Radius"],
-                                    data["Colour"]))
+                                    data["Colour"], data["Test_Particle"]))
         
         # Cache loaded simulation
         self.cache[sim_name] = self.particle_lst
@@ -281,6 +317,9 @@ class Database_manager():
     def _txt_to_arr(self, some_data):
         result = []
         for particle in some_data:
+            if particle[0].startswith("{"):  # Encoded payload, decoded straight to an array
+                result.append(decode_payload(json.loads(particle[0])))
+                continue
             particle = list(particle)
             particle[0] = particle[0].strip("[").strip("]").split(">,")
 
@@ -295,6 +334,18 @@ class Database_manager():
             result.append(lst)
         return result
     
+    # Convert a packed trajectory to a (frames, 3) array viewing the blob's bytes
+    def _blob_to_arr(self, blob, data_type):
+        return np.frombuffer(blob, dtype=np.dtype(data_type)).reshape(-1, 3)
+
+    # Packed bytes of one particle's trajectory, and the dtype to read them back with
+    def _arr_to_blob(self, trajectory, i):
+        values = trajectory.particle(i)
+        if self.encoding == "float32":
+            values = values.astype(np.float32)
+        values = np.ascontiguousarray(values)
+        return values.tobytes(), values.dtype.str
+
     # Initialize database schema
     def initialize_database(self, db_name="ParticleDatabase.db"):
         try:
@@ -310,7 +361,9 @@ class Database_manager():
                 No_Particles INTEGER,
                 Rate FLOAT,
                 Duration FLOAT,
-                Interval FLOAT
+                Interval FLOAT,
+                Integrator TEXT,
+                OutputStride INTEGER
             )
             """)
             # Particle configurations table
@@ -324,7 +377,8 @@ class Database_manager():
                 StartVel TEXT,
                 StartAcc TEXT,
                 Radius FLOAT,
-                Colour TEXT
+                Colour TEXT,
+                TestParticle INTEGER
             )
             """)
             # Trajectory data storage
@@ -333,7 +387,11 @@ class Database_manager():
                 ParticleID INTEGER,
                 Pos_Data TEXT,
                 Vel_Data TEXT,
-                Acc_Data TEXT
+                Acc_Data TEXT,
+                Pos_Blob BLOB,
+                Vel_Blob BLOB,
+                Acc_Blob BLOB,
+                DataType TEXT
             )
             """)
             # User authentication table
@@ -355,18 +413,54 @@ class Database_manager():
                         FOREIGN KEY (CreatorID) REFERENCES Users(UserID)
                             )""")
             
+            # Collision events, one row per collision
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Collisions (
+                EventID INTEGER PRIMARY KEY AUTOINCREMENT,
+                Sim_Name TEXT,
+                Step INTEGER,
+                First INTEGER,
+                Second INTEGER,
+                NormalX FLOAT,
+                NormalY FLOAT,
+                NormalZ FLOAT,
+                RelativeSpeed FLOAT,
+                Impulse FLOAT
+            )""")
+
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS SimulationDependencies (
                 ChildSim TEXT PRIMARY KEY,
                 ParentSim TEXT
             )""")
 
+            # Bring databases created by older versions up to the current schema
+            self._add_missing_columns(cursor, "Simulations", {"Integrator": "TEXT", "OutputStride": "INTEGER"})
+            self._add_missing_columns(cursor, "Particles", {"TestParticle": "INTEGER"})
+            self._add_missing_columns(cursor, "Particles_Data", {"Pos_Blob": "BLOB", "Vel_Blob": "BLOB",
+                                                                 "Acc_Blob": "BLOB", "DataType": "TEXT"})
+            self._rename_columns(cursor, "Collisions", {"Frame": "Step"})
+
             connection.commit()
         except sqlite3.Error as e:
             print(f"Database initialization error: {e}")
         finally:
             connection.close()
 
+    # Add columns introduced after a table was first created
+    def _add_missing_columns(self, cursor, table, columns):
+        existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        for column, column_type in columns.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    # Rename columns whose meaning was clarified after a table was first created
+    def _rename_columns(self, cursor, table, columns):
+        existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        for old, new in columns.items():
+            if old in existing and new not in existing:
+                cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {old} TO {new}")
+
     # Save simulation to database
     def dump_to_db(self, username):
         creator_id = self.get_user_id(username)
@@ -374,7 +468,8 @@ class Database_manager():
         # Prepare simulation metadata
         tblTemps = [(self.sim_data["Sim_Name"], creator_id,
                     self.sim_data["No_Pars"], self.sim_data["Rate"],
-                    self.sim_data["Run Time"], self.sim_data["Increment"])]
+                    self.sim_data["Run Time"], self.sim_data["Increment"],
+                    self.sim_data["Integrator"], self.sim_data["Output_Stride"])]
         
         if not os.path.exists("ParticleDatabase.db"):
             self.initialize_database()
@@ -384,7 +479,8 @@ class Database_manager():
                     
         # Insert simulation metadata
         cursor.executemany("""
-            INSERT INTO Simulations VALUES (?,?,?,?,?,?)
+            INSERT INTO Simulations (Sim_Name, UserID, No_Particles, Rate, Duration, Interval, Integrator,
+            OutputStride) VALUES (?,?,?,?,?,?,?,?)
         """, tblTemps)
 
         if self.name_exists(self.sim_data["Sim_Name"]):
@@ -392,15 +488,35 @@ class Database_manager():
 
         # Insert particle configurations
         tblTemps = [(self.sim_data["Sim_Name"], par["Charge"], par["Mass"], str(par["Position"]),
-                    str(par["Velocity"]), str(par["Acceleration"]), par["Radius"], str(par["Colour"]))
+                    str(par["Velocity"]), str(par["Acceleration"]), par["Radius"], str(par["Colour"]),
+                    int(par.get("Test_Particle", False)))
                     for par in self.par_data]
         cursor.executemany("""INSERT INTO Particles (Sim_Name, Charge, Mass, StartPos,
-        StartVel, StartAcc, Radius, Colour) VALUES (?,?,?,?,?,?,?,?)""", tblTemps)
-
-        # Insert trajectory data
-        tblTemps = [(str(self.pos_data_raw[i]), str(self.vel_data_raw[i]),
-                    str(self.acc_data_raw[i])) for i in range(len(self.par_data))]
-        cursor.executemany("INSERT INTO Particles_Data (Pos_Data, Vel_Data, Acc_Data) VALUES (?,?,?)", tblTemps)
+        StartVel, StartAcc, Radius, Colour, TestParticle) VALUES (?,?,?,?,?,?,?,?,?)""", tblTemps)
+
+        cursor.execute("SELECT ParticleID FROM Particles WHERE Sim_Name = ? ORDER BY ParticleID",
+                       (self.sim_data["Sim_Name"],))
+        particle_ids = [row[0] for row in cursor.fetchall()]
+
+        # Insert trajectory data, as packed float arrays unless a compressed encoding was chosen
+        if self.encoded_data is None:
+            tblTemps = []
+            for i, par_id in enumerate(particle_ids):
+                packed = [self._arr_to_blob(trajectory, i) for trajectory in self.trajectories]
+                tblTemps.append((par_id, None, None, None, *(blob for blob, _ in packed), packed[0][1]))
+        else:
+            tblTemps = [(par_id, *(json.dumps(channel[i]) for channel in self.encoded_data), None, None, None, None)
+                        for i, par_id in enumerate(particle_ids)]
+        cursor.executemany("""INSERT INTO Particles_Data (ParticleID, Pos_Data, Vel_Data, Acc_Data, Pos_Blob,
+        Vel_Blob, Acc_Blob, DataType) VALUES (?,?,?,?,?,?,?,?)""", tblTemps)
+
+        # Insert collision events
+        log = self.collision_log
+        tblTemps = [(self.sim_data["Sim_Name"], step, first, second, *normal, speed, impulse)
+                    for step, first, second, normal, speed, impulse in zip(
+                        *(log.column(name).tolist() for name in Collision_Log.COLUMNS))]
+        cursor.executemany("""INSERT INTO Collisions (Sim_Name, Step, First, Second, NormalX, NormalY,
+        NormalZ, RelativeSpeed, Impulse) VALUES (?,?,?,?,?,?,?,?,?)""", tblTemps)
 
         connection.commit()
         connection.close()
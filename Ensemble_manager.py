@@ -0,0 +1,320 @@
+from collections import OrderedDict
+from copy import deepcopy
+import numpy as np
+from vpython import vector
+from Particle_manager import Particle, SimulationState, Vectorised_Particle_Group, COULOMB_K, GRAVITY_G, MAGNETIC_K
+from Integrator_manager import make_integrator
+
+def sweep(index, key, values):
+    """Variants that change one property of one particle, e.g. sweep(0, "Mass", [1, 2, 4])"""
+    return [{index: {key: value}} for value in values]
+
+
+class Ensemble_Particle_Group:
+    """K variants of the same particle setup held as (K, N, 3) and (K, N) arrays.
+
+    Every variant starts from the same particles, with its own charges, masses,
+    initial positions or velocities given as overrides. One step of the batched
+    direct sum advances all K variants at once, so the interaction kernel and the
+    integrators see the same pos/vel/acc/charge/mass attributes as
+    Vectorised_Particle_Group, only with a leading variant axis.
+    """
+    def __init__(self, list_particle_objs, variants, initial_velocities=None, chunk_size=256):
+        self.array_particles = list_particle_objs
+        self.array_size = len(list_particle_objs)
+        self.variants = variants
+        self.size = len(variants)
+        self.chunk_size = chunk_size
+        self._kernels = {}
+
+        if initial_velocities is None:
+            initial_velocities = [p.velocity for p in list_particle_objs]
+        base = {
+            "Charge": [p.charge for p in list_particle_objs],
+            "Mass": [p.mass for p in list_particle_objs],
+            "Position": [p.initial_pos for p in list_particle_objs],
+            "Velocity": initial_velocities,
+        }
+        self.conditions = [self._apply_overrides(base, overrides) for overrides in variants]
+
+        self.charge = np.array([c["Charge"] for c in self.conditions], dtype=float).reshape(self.size, -1)
+        self.mass = np.array([c["Mass"] for c in self.conditions], dtype=float).reshape(self.size, -1)
+        self.pos = np.array([[[v.x, v.y, v.z] for v in c["Position"]] for c in self.conditions], dtype=float).reshape(self.size, -1, 3)
+        self.vel = np.array([[[v.x, v.y, v.z] for v in c["Velocity"]] for c in self.conditions], dtype=float).reshape(self.size, -1, 3)
+        self.acc = np.zeros_like(self.pos)
+        self.radius = np.array([p.radius for p in list_particle_objs], dtype=float)
+        self.sources = np.array([i for i, p in enumerate(list_particle_objs) if not p.is_test_particle], dtype=int)
+
+    def _apply_overrides(self, base, overrides):
+        conditions = {key: list(values) for key, values in base.items()}
+        for index, changes in overrides.items():
+            for key, value in changes.items():
+                if key not in conditions:
+                    raise KeyError(f"Variants can only change {', '.join(conditions)}, not {key}")
+                conditions[key][index] = value
+        return conditions
+
+    def resetAccelerations(self):
+        self.acc[:] = 0.0
+
+    def _field_sums(self, kinds):
+        """Batched source sums, d_ij = pos_j - pos_i within each variant:
+            "charge":  sum_j q_j d_ij / r^3
+            "mass":    sum_j m_j d_ij / r^3
+            "current": sum_j (q_j v_j) x d_ij / r^3
+        j only runs over the source particles, as in Vectorised_Particle_Group.
+        """
+        epsilon = 1e-9
+        n = self.array_size
+        sources = self.sources
+        source_pos = self.pos[:, sources]
+        moment = self.charge[:, sources, np.newaxis] * self.vel[:, sources]
+        sums = {kind: np.zeros((self.size, n, 3)) for kind in kinds}
+
+        # Keep each (K, rows, N) block to roughly chunk_size rows of a single run
+        rows = max(1, self.chunk_size // max(self.size, 1))
+        for start in range(0, n, rows):
+            stop = min(start + rows, n)
+            disp = source_pos[:, np.newaxis, :, :] - self.pos[:, start:stop, np.newaxis, :]
+            r = np.sqrt(np.einsum("kijd,kijd->kij", disp, disp)) + epsilon
+            inv_r3 = 1.0 / r**3
+            for kind in kinds:
+                if kind == "current":
+                    sums[kind][:, start:stop] = np.einsum("kijd,kij->kid", np.cross(moment[:, np.newaxis, :, :], disp), inv_r3)
+                else:
+                    w = (self.charge if kind == "charge" else self.mass)[:, sources]
+                    sums[kind][:, start:stop] = np.einsum("kijd,kij,kj->kid", disp, inv_r3, w)
+        return sums
+
+    def magnetic_field(self):
+        return MAGNETIC_K * self._field_sums(("current",))["current"]
+
+    def interaction_kernel(self, E, M, G):
+        key = (bool(E), bool(M), bool(G))
+        if key not in self._kernels:
+            self._kernels[key] = self._make_kernel(*key)
+        return self._kernels[key]
+
+    def _make_kernel(self, E, M, G):
+        kinds = [kind for kind, on in (("charge", E), ("current", M), ("mass", G)) if on]
+
+        def kernel(targets=None):
+            if targets is not None:
+                raise ValueError("Ensemble runs always update every particle")
+            if not kinds:
+                return
+            sums = self._field_sums(kinds)
+            specific_charge = (self.charge / self.mass)[:, :, np.newaxis]
+            if E:
+                self.acc -= COULOMB_K * specific_charge * sums["charge"]
+            if G:
+                self.acc += GRAVITY_G * sums["mass"]
+            if M:
+                B = MAGNETIC_K * sums["current"]
+                self.acc += specific_charge * np.cross(self.vel, B)
+        return kernel
+
+    def advance(self, dt):
+        self.vel += self.acc * dt
+        self.pos += self.vel * dt
+
+
+class Derived_Acceleration:
+    """Acceleration channel recomputed from the recorded positions and velocities instead of being stored.
+
+    Frames are evaluated a chunk at a time, each chunk as one batch of the
+    Ensemble_Particle_Group direct sum with the frames along the variant axis,
+    and the most recently used chunks are cached. Frame f is the field
+    acceleration at position and velocity frame f, the same as a stored
+    acceleration channel. A run with a field solver or a cutoff is evaluated
+    one frame at a time through a Vectorised_Particle_Group set up the same way,
+    so the derived forces are the ones the run used. Offers the reading side of
+    Trajectory: lengths, frames, frame, block, particle.
+    """
+    def __init__(self, particles, pos, vel, fields, chunk_frames=64, max_chunks=16, field_solver=None, cutoff=None,
+                 skin=None):
+        self.particles = particles
+        self.pos = pos
+        self.vel = vel
+        self.fields = fields
+        self.chunk_frames = chunk_frames
+        self.max_chunks = max_chunks
+        self.dtype = pos.dtype
+        self.group = Ensemble_Particle_Group(particles, [{}])
+        self.charge = self.group.charge[0]
+        self.mass = self.group.mass[0]
+        self.kernel = self.group.interaction_kernel(*fields)
+        self.field_solver = field_solver
+        self.cutoff = cutoff
+        self.skin = skin
+        self.frame_group = None
+        if field_solver is not None or cutoff is not None:
+            # Its own copy of the solver, which keeps per-build state
+            self.frame_group = Vectorised_Particle_Group(particles, deepcopy(field_solver))
+            if cutoff is not None:
+                self.frame_group.set_cutoff(cutoff, skin)
+            self.frame_kernel = self.frame_group.interaction_kernel(*fields)
+        self._cache = OrderedDict()
+
+    def __deepcopy__(self, memo):
+        # The kernel is a closure over this object's group, so a copy needs its own
+        return Derived_Acceleration(deepcopy(self.particles, memo), deepcopy(self.pos, memo), deepcopy(self.vel, memo),
+                                    self.fields, self.chunk_frames, self.max_chunks, self.field_solver, self.cutoff,
+                                    self.skin)
+
+    @property
+    def lengths(self):
+        return np.minimum(self.pos.lengths, self.vel.lengths)
+
+    @property
+    def frames(self):
+        return int(self.lengths.max(initial=0))
+
+    def clear(self):
+        self._cache.clear()
+
+    def _chunk(self, index):
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        start = index * self.chunk_frames
+        stop = min(start + self.chunk_frames, self.frames)
+        if self.frame_group is not None:
+            acc = np.empty((stop - start,) + self.pos.data.shape[1:], dtype=self.dtype)
+            for f in range(start, stop):
+                acc[f - start] = self._frame_acceleration(f)
+        else:
+            acc = self._batched_acceleration(start, stop)
+
+        # A chunk still being recorded is recomputed next time
+        if stop - start == self.chunk_frames:
+            self._cache[index] = acc
+            if len(self._cache) > self.max_chunks:
+                self._cache.popitem(last=False)
+        return acc
+
+    def _batched_acceleration(self, start, stop):
+        group = self.group
+        group.size = stop - start
+        group.pos = self.pos.block(start, stop).astype(float)
+        group.vel = self.vel.block(start, stop).astype(float)
+        group.charge = np.broadcast_to(self.charge, group.pos.shape[:2])
+        group.mass = np.broadcast_to(self.mass, group.pos.shape[:2])
+        group.acc = np.zeros_like(group.pos)
+        self.kernel()
+        return group.acc.astype(self.dtype)
+
+    def _frame_acceleration(self, f):
+        group = self.frame_group
+        group.set_motion(self.pos.frame(f), self.vel.frame(f))
+        group._precompute_pair_data()
+        group.resetAccelerations()
+        self.frame_kernel()
+        return group.acc
+
+    def frame(self, f):
+        return self._chunk(f // self.chunk_frames)[f % self.chunk_frames]
+
+    def block(self, start, stop):
+        if stop <= start:
+            return np.empty((0,) + self.pos.data.shape[1:], dtype=self.dtype)
+        first, last = start // self.chunk_frames, (stop - 1) // self.chunk_frames
+        offset = first * self.chunk_frames
+        chunks = np.concatenate([self._chunk(index) for index in range(first, last + 1)])
+        return chunks[start - offset:stop - offset]
+
+    def particle(self, i):
+        return self.block(0, self.lengths[i])[:, i]
+
+
+def attach_derived_channels(store, field_solver=None, cutoff=None, skin=None):
+    """Set up recomputation of the channels a "primary" profile store doesn't keep, from store.fields
+    and the field solver and cutoff the run was computed with"""
+    if store.profile == "primary":
+        store.derived["acc"] = Derived_Acceleration(store.particles, store.trajectories["pos"],
+                                                    store.trajectories["vel"], store.fields, field_solver=field_solver,
+                                                    cutoff=cutoff, skin=skin)
+
+
+class Ensemble:
+    """Runs K variants of one simulation side by side and records each into its own SimulationState.
+
+    variants is a list of {particle_index: {"Charge"|"Mass"|"Position"|"Velocity": value}}
+    overrides, one dict per run; an empty dict is the unchanged setup. Collisions are
+    not resolved in ensemble runs.
+    """
+    def __init__(self, SimulationState_obj, variants, E=True, M=True, G=True, integrator=None):
+        self.store = SimulationState_obj
+        self.E = E
+        self.M = M
+        self.G = G
+        self.integrator_name = integrator or SimulationState_obj.integrator
+        self.integrator = make_integrator(self.integrator_name)
+        if self.integrator_name == "block":
+            raise ValueError("Block time steps can't be shared between ensemble variants")
+
+        initial_velocities = [vel[0] if vel else p.velocity
+                              for p, vel in zip(SimulationState_obj.particles, SimulationState_obj.vel_data)]
+        self.particles = Ensemble_Particle_Group(SimulationState_obj.particles, variants, initial_velocities)
+
+        if self.integrator.handles_magnetic:
+            self.integrator.magnetic = M
+        kernel_M = M and not self.integrator.handles_magnetic
+        self.acc_kernel = self.particles.interaction_kernel(E, kernel_M, G)
+        self.stores = [self._make_store(k) for k in range(self.particles.size)]
+
+    def _make_store(self, k):
+        conditions = self.particles.conditions[k]
+        particles = [
+            Particle(conditions["Charge"][i], conditions["Mass"][i], conditions["Position"][i],
+                     conditions["Velocity"][i], vector(0, 0, 0), p.radius, p.colour, p.is_test_particle)
+            for i, p in enumerate(self.particles.array_particles)
+        ]
+        store = SimulationState(particles, self.store.dtype, self.store.storage, self.store.storage_dir,
+                                self.store.profile)
+        store.build(f"{self.store.sim_name} #{k + 1}", self.store.sim_rate, self.store.sim_increment,
+                    self.store.sim_duration, self.integrator_name)
+        store.set_output_stride(self.store.output_stride, self.store.record_aggregates)
+        store.fields = (self.E, self.M, self.G)
+        attach_derived_channels(store)
+        return store
+
+    def _evaluate_accelerations(self, targets=None):
+        self.particles.resetAccelerations()
+        self.acc_kernel(targets)
+
+    def _recorded_acceleration(self, exact=True):
+        # Field accelerations at the current state of every variant, as Sim._recorded_acceleration
+        group = self.particles
+        acc = group.acc
+        if not exact:
+            kept = group.acc.copy()
+            self._evaluate_accelerations()
+            acc = group.acc.copy()
+            group.acc[:] = kept
+        if self.integrator.handles_magnetic and self.M:
+            acc = acc + (group.charge / group.mass)[..., np.newaxis] * np.cross(group.vel, group.magnetic_field())
+        return acc
+
+    def _record(self, acc):
+        group = self.particles
+        for k, store in enumerate(self.stores):
+            store.add_step(group.pos[k], group.vel[k], acc[k])
+
+    def pre_compute(self):
+        """Advance every variant over the stored duration; returns one SimulationState per variant"""
+        t = 0
+        dt = self.store.sim_increment
+        self._evaluate_accelerations()
+        acc = self._recorded_acceleration()
+        for k, store in enumerate(self.stores):
+            store.add_frame(acc=acc[k])
+
+        while t < self.store.sim_duration:
+            acc_ready = self.integrator.step(self.particles, dt, self._evaluate_accelerations)
+            exact = not acc_ready or (self.integrator.acc_at_new_state and not self.M)
+            if not acc_ready:
+                self._evaluate_accelerations()
+            self._record(self._recorded_acceleration(exact) if self.stores[0].records_next_step else self.particles.acc)
+            t += dt
+        return self.stores
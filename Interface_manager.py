@@ -4,6 +4,7 @@ from os import listdir
 from os.path import isfile, join
 import pathlib
 from Dependency_graph import DependencyGraph
+from Integrator_manager import INTEGRATORS
 
 class Interface_manager:
     def __init__(self):
@@ -23,6 +24,10 @@ class Interface_manager:
         self.sim_isE_msg = "TURN ELECTRIC FIELDS ON (y/n) : "
         self.sim_isM_msg = "TURN MAGNETIC EFFECTS ON (y/n) : "
         self.sim_isG_msg = "TURN GRAVITATIONAL FIELDS ON (y/n) : "
+        self.sim_integrator_msg = "ENTER INTEGRATOR ({}) : ".format("/".join(INTEGRATORS))
+        self.sim_stride_msg = "RECORD EVERY N STEPS (1 RECORDS EVERY STEP) : "
+        self.sim_increment_msg = "ENTER TIME STEP IN SECONDS (~0.00001, LARGER FOR VERLET/RK4/BORIS/BLOCK) : "
+        self.invalid_increment_msg = "INVALID - TIME STEP MUST BE POSITIVE"
         self.enter_par_msg = """
         ***PARTICLE INFORMATION***
         
@@ -35,6 +40,7 @@ class Interface_manager:
 
         1. REPRESENTING POSITION AND VELOCITY LIKE SO:(X_VALUE,Y_VALUE,Z_VALUE)
         2. CHOOSING A COLOUR FROM: red, orange, green, blue, purple, black, white
+        3. ADDING "test" AT THE END FOR A TEST PARTICLE, WHICH FEELS FIELDS BUT CREATES NONE
 
         example choice: 0.25 100 (0,0,0) 0.25 red (0,0,0)
 
@@ -128,14 +134,21 @@ class Interface_manager:
             self.dependency_graph.add_dependency(parent_sim, name)
 
         self.rate = self.real_num_inp(self.sim_rate_msg)
-        increment = 0.00001
         duration = self.real_num_inp(self.sim_dur_msg)
         isE, isM, isG = (self.y_n_input(msg) for msg in [self.sim_isE_msg, self.sim_isM_msg, self.sim_isG_msg])
+        integrator = self.option_input(self.sim_integrator_msg, list(INTEGRATORS))
+        # The stable integrators can take larger steps, so the step isn't fixed
+        increment = self.real_num_inp(self.sim_increment_msg)
+        while increment <= 0:
+            print(self.invalid_increment_msg)
+            increment = self.real_num_inp(self.sim_increment_msg)
+        output_stride = max(1, int(self.real_num_inp(self.sim_stride_msg)))
 
         print(self.enter_par_msg)
         particle_lst = self.par_desc_inp()
         self.store = SimulationState(particle_lst)
-        self.store.build(name, self.rate, increment, duration)
+        self.store.build(name, self.rate, increment, duration, integrator)
+        self.store.set_output_stride(output_stride)
 
         with_analysis = self.y_n_input(self.ask_analys_msg)
         graph_variables = self.analysis_var_input() if with_analysis else None
@@ -153,9 +166,10 @@ class Interface_manager:
             self.simulation.load_graphs(graph_variables)
 
             
-        self.simulation.pre_compute()
+        self.simulation.start_stream()
 
         if with_minmax:
+            self.simulation.finish_stream()  # The statistics need the whole run
             self.simulation.calc_and_display_minmax()
 
         self.simulation.Run()
@@ -246,7 +260,7 @@ class Interface_manager:
             """)
 
         self.simulation = SimulationVisualiser(self.store, E=isE, M=isM, G=isG) if with_analysis else Sim(self.store, E=isE, M=isM, G=isG)
-        self.simulation.pre_compute()
+        self.simulation.start_stream()
         self.simulation.Run()
 
     def get_filenames(self):
@@ -259,6 +273,13 @@ class Interface_manager:
                 return variable
             print(self.invalid_msg)
 
+    def option_input(self, msg, options):
+        while True:
+            variable = input(msg).strip().lower()
+            if variable in options:
+                return variable
+            print(self.invalid_msg)
+
     def y_n_input(self, msg):
         while True:
             variable = input(msg).lower()
@@ -295,6 +316,9 @@ class Interface_manager:
                 return particles_lst
 
             par_desc = par_desc.split()
+            is_test = par_desc[-1].lower() == "test"
+            if is_test:
+                par_desc = par_desc[:-1]
             if par_desc[0].lower() in ["proton", "electron", "neutron"]:
                 particle_properties = {
                     "proton": (0.25, 100, vector(0, 0, 0), "red", 0.25),
@@ -317,7 +341,7 @@ class Interface_manager:
                 
 
             positions_taken.append(pos_vector)
-            particles_lst.append(Particle(charge, mass, pos_vector, vel_vector, vector(0, 0, 0), radius, chosen_color))
+            particles_lst.append(Particle(charge, mass, pos_vector, vel_vector, vector(0, 0, 0), radius, chosen_color, is_test))
 
     def valid_vector_inp(self, inp):
         try:
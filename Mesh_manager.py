@@ -0,0 +1,119 @@
+import numpy as np
+
+class Particle_Mesh_Solver:
+    """Particle-mesh (FFT Poisson) replacement for the direct pair sum.
+
+    Charge, mass and current (q*v) are deposited onto a cubic grid with
+    cloud-in-cell weighting. The potential psi_w(r) = sum_j w_j / |r - r_j| is
+    found with NumPy FFTs and differentiated on the grid; the result is then
+    interpolated back to the particles with the same cloud-in-cell weights.
+
+    Boundaries:
+        "open"     - the grid is fitted around the particles every step and
+                     zero-padded to twice its size so the convolution with 1/r
+                     is not periodic (Hockney-Eastwood)
+        "periodic" - a fixed box of side box_size starting at origin, with the
+                     mean density removed as a neutralising background
+
+    The source sums follow the same convention as the direct kernel:
+        "charge":  sum_j q_j d_ij / r^3  = grad psi_q
+        "mass":    sum_j m_j d_ij / r^3  = grad psi_m
+        "current": sum_j (q_j v_j) x d_ij / r^3  = -curl psi_J
+    """
+    def __init__(self, grid_size=32, boundary="open", box_size=None, origin=None):
+        if boundary not in ("open", "periodic"):
+            raise ValueError(f"Unknown mesh boundary: {boundary}")
+        if boundary == "periodic" and box_size is None:
+            raise ValueError("A periodic mesh needs a box_size")
+
+        self.grid_size = grid_size
+        self.boundary = boundary
+        self.box_size = box_size
+        self.origin = None if origin is None else np.asarray(origin, dtype=float)
+        if boundary == "periodic" and self.origin is None:
+            self.origin = np.full(3, -box_size / 2)
+        self._sums = {}
+
+    def build(self, pos, charge, mass, vel):
+        """Set up the grid and cloud-in-cell weights for the current particle state"""
+        self.pos = pos
+        self.charge = charge
+        self.mass = mass
+        self.vel = vel
+        self._sums = {}
+
+        M = self.grid_size
+        if self.boundary == "periodic":
+            self.spacing = self.box_size / M
+            x = (pos - self.origin) / self.spacing % M
+        else:
+            lower = pos.min(axis=0) if len(pos) else np.zeros(3)
+            upper = pos.max(axis=0) if len(pos) else np.zeros(3)
+            extent = max(float(np.max(upper - lower)), 1e-9)
+            # Keep one spare node on each side so the CIC stencil only ever meets central differences
+            self.spacing = extent / (M - 3)
+            self.grid_origin = lower - self.spacing
+            x = np.clip((pos - self.grid_origin) / self.spacing, 1, M - 2 - 1e-9)
+
+        base = np.floor(x).astype(int)
+        frac = x - base
+        self._stencil = []
+        for corner in range(8):
+            offset = np.array([(corner >> axis) & 1 for axis in range(3)])
+            weight = np.prod(np.where(offset, frac, 1 - frac), axis=1)
+            self._stencil.append((tuple(((base + offset) % M).T), weight))
+
+    def _deposit(self, weights):
+        grid = np.zeros((self.grid_size,) * 3)
+        for index, cic in self._stencil:
+            np.add.at(grid, index, weights * cic)
+        return grid
+
+    def _interpolate(self, grid):
+        return sum(grid[index] * cic for index, cic in self._stencil)
+
+    def _potential(self, deposited):
+        """psi on the grid for deposited per-cell weights"""
+        M = self.grid_size
+        h = self.spacing
+        if self.boundary == "periodic":
+            n = np.fft.fftfreq(M) * 2 * np.pi
+            # Eigenvalues of the 7-point Laplacian, consistent with the finite differences below
+            k2 = sum(np.meshgrid(*([(2 - 2 * np.cos(n)) / h**2] * 3), indexing="ij", sparse=True))
+            k2[0, 0, 0] = 1.0
+            psi_k = 4 * np.pi * np.fft.fftn(deposited / h**3) / k2
+            psi_k[0, 0, 0] = 0.0
+            return np.real(np.fft.ifftn(psi_k))
+
+        # Free-space Green's function on the doubled grid
+        distance = np.minimum(np.arange(2 * M), 2 * M - np.arange(2 * M)) * h
+        dx, dy, dz = np.meshgrid(distance, distance, distance, indexing="ij", sparse=True)
+        r = np.sqrt(dx**2 + dy**2 + dz**2)
+        r[0, 0, 0] = h / 2
+        green = 1.0 / r
+        padded = np.zeros((2 * M,) * 3)
+        padded[:M, :M, :M] = deposited
+        psi = np.fft.irfftn(np.fft.rfftn(padded) * np.fft.rfftn(green), s=padded.shape, axes=(0, 1, 2))
+        return psi[:M, :M, :M]
+
+    def _derivative(self, grid, axis):
+        if self.boundary == "periodic":
+            return (np.roll(grid, -1, axis) - np.roll(grid, 1, axis)) / (2 * self.spacing)
+        return np.gradient(grid, self.spacing, axis=axis)
+
+    def source_sums(self, kinds):
+        return {kind: self._source_sum(kind) for kind in kinds}
+
+    def _source_sum(self, kind):
+        if kind not in self._sums:
+            if kind == "current":
+                moment = self.charge[:, np.newaxis] * self.vel
+                psi = [self._potential(self._deposit(moment[:, axis])) for axis in range(3)]
+                d = self._derivative
+                curl = [d(psi[2], 1) - d(psi[1], 2), d(psi[0], 2) - d(psi[2], 0), d(psi[1], 0) - d(psi[0], 1)]
+                self._sums[kind] = -np.stack([self._interpolate(c) for c in curl], axis=1)
+            else:
+                weights = self.charge if kind == "charge" else self.mass
+                psi = self._potential(self._deposit(weights))
+                self._sums[kind] = np.stack([self._interpolate(self._derivative(psi, axis)) for axis in range(3)], axis=1)
+        return self._sums[kind]
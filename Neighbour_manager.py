@@ -0,0 +1,162 @@
+import numpy as np
+
+# The cell itself plus the 13 neighbouring cells "above" it, so each pair of cells is visited once
+HALF_SHELL = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+              if (dx, dy, dz) >= (0, 0, 0)]
+
+class Neighbour_List:
+    """Verlet neighbour list for short-range pair interactions.
+
+    Holds every pair closer than cutoff + skin, found with a uniform cell grid of
+    that size. The list is only rebuilt once some particle has moved more than
+    half the skin since the last build, so no pair can come inside the cutoff
+    without being on the list.
+    """
+    def __init__(self, cutoff, skin=None):
+        self.cutoff = cutoff
+        self.skin = 0.2 * cutoff if skin is None else skin
+        self.pairs = np.empty((0, 2), dtype=int)  # (i, j) index pairs with i < j
+        self.reference = None  # Positions at the last build
+        self.version = 0       # Incremented on every rebuild
+
+    def needs_rebuild(self, pos):
+        if self.reference is None or self.reference.shape != pos.shape:
+            return True
+        moved = pos - self.reference
+        return np.max(np.einsum("ij,ij->i", moved, moved), initial=0.0) > (self.skin / 2)**2
+
+    def update(self, pos):
+        """Rebuild the list if needed and return the current pairs"""
+        if self.needs_rebuild(pos):
+            self.build(pos)
+        return self.pairs
+
+    def build(self, pos):
+        reach = self.cutoff + self.skin
+        i, j = cell_pairs(pos, reach).T
+        d = pos[j] - pos[i]
+        close = np.einsum("ij,ij->i", d, d) < reach**2
+        self.pairs = np.stack([i[close], j[close]], axis=1)
+        self.reference = pos.copy()
+        self.version += 1
+
+
+class Spatial_Hash:
+    """Broad phase for collision detection.
+
+    Particles are hashed into cubic cells no smaller than the largest particle
+    diameter, so two spheres can only touch if they sit in the same or
+    neighbouring cells. The candidate pairs are rebuilt from scratch each frame.
+    """
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size  # None sizes the cells from the particle radii each frame
+        self.pairs = np.empty((0, 2), dtype=int)
+
+    def update(self, pos, radius):
+        """Rebuild the candidate (i, j) pairs, i < j, in row-major order"""
+        cell_size = self.cell_size or 2 * np.max(radius, initial=0.0)
+        if cell_size <= 0 or len(pos) < 2:
+            self.pairs = np.empty((0, 2), dtype=int)
+            return self.pairs
+        pairs = cell_pairs(pos, cell_size)
+        self.pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        return self.pairs
+
+
+def cell_pairs(pos, cell_size):
+    """Every (i, j) pair, i < j, of points in the same or neighbouring cells of a uniform grid"""
+    cells = np.floor(pos / cell_size).astype(int)
+    buckets = {}
+    for index, cell in enumerate(map(tuple, cells)):
+        buckets.setdefault(cell, []).append(index)
+    buckets = {cell: np.array(members) for cell, members in buckets.items()}
+
+    found = []
+    for (cx, cy, cz), members in buckets.items():
+        for dx, dy, dz in HALF_SHELL:
+            others = buckets.get((cx + dx, cy + dy, cz + dz))
+            if others is None:
+                continue
+            if (dx, dy, dz) == (0, 0, 0):
+                a, b = np.triu_indices(len(members), 1)
+                found.append(np.stack([members[a], members[b]], axis=1))
+            else:
+                found.append(np.stack([np.repeat(members, len(others)), np.tile(others, len(members))], axis=1))
+
+    pairs = np.concatenate(found) if found else np.empty((0, 2), dtype=int)
+    pairs.sort(axis=1)
+    return pairs
+
+
+class Sweep_And_Prune:
+    """Incremental sweep-and-prune broad phase for collision detection.
+
+    Each particle's bounding box is kept as a min and a max endpoint on every
+    axis, in sorted lists that are repaired with an insertion sort each frame.
+    Particles move very little between frames, so this is close to linear. Every
+    swap of a min and a max endpoint starts or ends an overlap on that axis, and
+    a pair whose boxes overlap on all axes is reported as added, or as removed
+    once they stop doing so.
+    """
+    def __init__(self, axes=(0, 1, 2)):
+        self.axes = axes
+        self.endpoints = None   # Per axis, sorted [value, particle index, is_max] lists
+        self.overlaps = {}      # (i, j) -> number of axes whose intervals overlap
+        self.pairs = set()      # (i, j) pairs, i < j, whose boxes overlap on every axis
+
+    def update(self, pos, radius):
+        """Move the endpoints to the new positions; returns (added, removed) pair lists"""
+        before = set(self.pairs)
+        if self.endpoints is None or len(self.endpoints[0]) != 2 * len(pos):
+            self._build(pos, radius)
+        else:
+            for a, axis in enumerate(self.axes):
+                self._sort_axis(self.endpoints[a], pos[:, axis] - radius, pos[:, axis] + radius)
+        return sorted(self.pairs - before), sorted(before - self.pairs)
+
+    def _build(self, pos, radius):
+        self.overlaps = {}
+        self.pairs = set()
+        self.endpoints = []
+        for axis in self.axes:
+            lower = pos[:, axis] - radius
+            upper = pos[:, axis] + radius
+            ends = [[lower[i], i, False] for i in range(len(pos))] + [[upper[i], i, True] for i in range(len(pos))]
+            ends.sort(key=lambda end: (end[0], end[2]))
+            open_boxes = set()
+            for value, index, is_max in ends:
+                if is_max:
+                    open_boxes.discard(index)
+                else:
+                    for other in open_boxes:
+                        self._count((min(index, other), max(index, other)), 1)
+                    open_boxes.add(index)
+            self.endpoints.append(ends)
+
+    def _sort_axis(self, ends, lower, upper):
+        for end in ends:
+            end[0] = upper[end[1]] if end[2] else lower[end[1]]
+
+        for k in range(1, len(ends)):
+            end = ends[k]
+            m = k - 1
+            while m >= 0 and ends[m][0] > end[0]:
+                other = ends[m]
+                if end[2] != other[2] and end[1] != other[1]:
+                    pair = (min(end[1], other[1]), max(end[1], other[1]))
+                    # A min passing below a max starts an overlap, a max passing below a min ends one
+                    self._count(pair, -1 if end[2] else 1)
+                ends[m + 1] = other
+                m -= 1
+            ends[m + 1] = end
+
+    def _count(self, pair, change):
+        count = self.overlaps.get(pair, 0) + change
+        if count:
+            self.overlaps[pair] = count
+        else:
+            self.overlaps.pop(pair, None)
+        if count == len(self.axes):
+            self.pairs.add(pair)
+        else:
+            self.pairs.discard(pair)
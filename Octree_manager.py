@@ -0,0 +1,138 @@
+import numpy as np
+
+class Octree_Node:
+    def __init__(self, indices, center, half):
+        self.indices = indices  # Particle indices contained in this cube
+        self.center = center    # Geometric centre of the cube
+        self.half = half        # Half of the cube's side length
+        self.children = None    # Child nodes, None for a leaf
+
+        # Multipole moments, filled in by Barnes_Hut_Solver._set_moments
+        self.com = None
+        self.total = {}
+        self.dipole = {}
+        self.current = None
+
+
+class Barnes_Hut_Solver:
+    """Tree-code replacement for the direct pair sum in Vectorised_Particle_Group.
+
+    An octree is rebuilt over the particle positions every step. Clusters that
+    subtend less than the opening angle theta are approximated by their monopole
+    and dipole moments (taken about the cluster's centre of mass), so the cost per
+    step is O(N log N) instead of O(N^2).
+
+    source_sums(kinds) returns the same source sums as the direct kernel, using
+    the convention d_ij = pos_j - pos_i:
+        "charge":  sum_j q_j d_ij / r^3
+        "mass":    sum_j m_j d_ij / r^3
+        "current": sum_j (q_j v_j) x d_ij / r^3
+    """
+    def __init__(self, theta=0.5, leaf_size=8, max_depth=32):
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+        self.epsilon = 1e-9
+        self.root = None
+        self._sums = None
+
+    def build(self, pos, charge, mass, vel):
+        """Rebuild the octree for the current particle state"""
+        self.pos = pos
+        self.vel = vel
+        self.weights = {"charge": charge, "mass": mass}
+        self._sums = None
+
+        if len(pos) == 0:
+            self.root = None
+            return
+
+        lower = pos.min(axis=0)
+        upper = pos.max(axis=0)
+        half = max(float(np.max(upper - lower)) / 2, self.epsilon)
+        self.root = self._build_node(np.arange(len(pos)), (lower + upper) / 2, half, 0)
+
+    def _build_node(self, indices, center, half, depth):
+        node = Octree_Node(indices, center, half)
+        self._set_moments(node)
+
+        if len(indices) <= self.leaf_size or depth >= self.max_depth:
+            return node
+
+        # Octant code: bit 0 for x, bit 1 for y, bit 2 for z
+        upper = self.pos[indices] > center
+        octants = upper @ np.array([1, 2, 4])
+        node.children = []
+        for octant in range(8):
+            sub = indices[octants == octant]
+            if sub.size == 0:
+                continue
+            signs = np.array([1 if octant & bit else -1 for bit in (1, 2, 4)])
+            node.children.append(self._build_node(sub, center + signs * half / 2, half / 2, depth + 1))
+        return node
+
+    def _set_moments(self, node):
+        pos = self.pos[node.indices]
+        mass = self.weights["mass"][node.indices]
+        total_mass = mass.sum()
+        node.com = (mass @ pos) / total_mass if total_mass != 0 else pos.mean(axis=0)
+
+        offsets = pos - node.com
+        for kind, weights in self.weights.items():
+            w = weights[node.indices]
+            node.total[kind] = w.sum()
+            node.dipole[kind] = w @ offsets
+        node.current = self.weights["charge"][node.indices] @ self.vel[node.indices]
+
+    def evaluate(self):
+        """Source sums for every particle, computed once per build"""
+        if self._sums is None:
+            n = len(self.pos)
+            self._sums = {kind: np.zeros((n, 3)) for kind in ("charge", "mass", "current")}
+            if self.root is not None:
+                self._walk(self.root, np.arange(n))
+        return self._sums
+
+    def source_sums(self, kinds):
+        sums = self.evaluate()
+        return {kind: sums[kind] for kind in kinds}
+
+    def _walk(self, node, targets):
+        # Every target is handled in one vectorised pass per visited node
+        target_pos = self.pos[targets]
+        D = node.com - target_pos
+        dist = np.sqrt(np.einsum("ij,ij->i", D, D)) + self.epsilon
+
+        outside = np.any(np.abs(target_pos - node.center) > node.half, axis=1)
+        far = outside & (2 * node.half / dist < self.theta)
+        if far.any():
+            self._apply_multipole(node, targets[far], D[far], dist[far])
+
+        near = targets[~far]
+        if near.size == 0:
+            return
+        if node.children is None:
+            self._apply_direct(node, near)
+        else:
+            for child in node.children:
+                self._walk(child, near)
+
+    def _apply_multipole(self, node, targets, D, dist):
+        inv_r3 = 1.0 / dist**3
+        D_hat = D / dist[:, np.newaxis]
+        for kind in ("charge", "mass"):
+            P = node.dipole[kind]
+            monopole = node.total[kind] * D * inv_r3[:, np.newaxis]
+            dipole = (P - 3 * (D_hat @ P)[:, np.newaxis] * D_hat) * inv_r3[:, np.newaxis]
+            self._sums[kind][targets] += monopole + dipole
+        self._sums["current"][targets] += np.cross(node.current, D) * inv_r3[:, np.newaxis]
+
+    def _apply_direct(self, node, targets):
+        sources = node.indices
+        disp = self.pos[np.newaxis, sources, :] - self.pos[targets, np.newaxis, :]
+        r = np.sqrt(np.einsum("ijk,ijk->ij", disp, disp)) + self.epsilon
+        inv_r3 = 1.0 / r**3
+        for kind in ("charge", "mass"):
+            self._sums[kind][targets] += np.einsum("ijk,ij,j->ik", disp, inv_r3, self.weights[kind][sources])
+        moment = self.weights["charge"][sources, np.newaxis] * self.vel[sources]
+        self._sums["current"][targets] += np.einsum("ijk,ij->ik", np.cross(moment[np.newaxis, :, :], disp), inv_r3)
@@ -0,0 +1,127 @@
+import weakref
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+
+KINDS = ("charge", "mass", "current")
+
+# Views onto the shared buffers, set up once in each worker process
+_shared = {}
+
+def _attach(input_name, partial_name, n, slots):
+    input_shm = SharedMemory(name=input_name)
+    partial_shm = SharedMemory(name=partial_name)
+    _shared["memory"] = (input_shm, partial_shm)  # Keep the mappings alive
+    _shared["inputs"] = np.ndarray((8, n), dtype=float, buffer=input_shm.buf)
+    _shared["partial"] = np.ndarray((slots, len(KINDS), n, 3), dtype=float, buffer=partial_shm.buf)
+
+def _run_tiles(task):
+    """Accumulate the source sums of a list of (I, J) tiles into one slot's partial buffer.
+
+    Each off-diagonal tile is evaluated once and applied to both its rows and its
+    columns, using d_ji = -d_ij, so every unordered pair is only visited once.
+    """
+    slot, tiles, kinds = task
+    inputs = _shared["inputs"]
+    pos = inputs[0:3].T
+    vel = inputs[3:6].T
+    weights = {"charge": inputs[6], "mass": inputs[7]}
+    moment = weights["charge"][:, np.newaxis] * vel
+    out = _shared["partial"][slot]
+    out[:] = 0.0
+
+    epsilon = 1e-9
+    for i0, i1, j0, j1 in tiles:
+        disp = pos[np.newaxis, j0:j1, :] - pos[i0:i1, np.newaxis, :]
+        r = np.sqrt(np.einsum("ijk,ijk->ij", disp, disp)) + epsilon
+        inv_r3 = 1.0 / r**3
+        diagonal = i0 == j0
+        for kind in kinds:
+            k = KINDS.index(kind)
+            if kind == "current":
+                out[k, i0:i1] += np.einsum("ijk,ij->ik", np.cross(moment[np.newaxis, j0:j1, :], disp), inv_r3)
+                if not diagonal:
+                    out[k, j0:j1] -= np.einsum("ijk,ij->jk", np.cross(moment[i0:i1, np.newaxis, :], disp), inv_r3)
+            else:
+                w = weights[kind]
+                out[k, i0:i1] += np.einsum("ijk,ij,j->ik", disp, inv_r3, w[j0:j1])
+                if not diagonal:
+                    out[k, j0:j1] -= np.einsum("ijk,ij,i->jk", disp, inv_r3, w[i0:i1])
+    return slot
+
+def _release(pool, memory):
+    if pool is not None:
+        pool.terminate()
+    for shm in memory:
+        shm.close()
+        shm.unlink()
+
+
+class Parallel_Pair_Solver:
+    """Direct pair sum spread over a multiprocessing pool.
+
+    Positions, velocities, charges and masses are copied into a
+    multiprocessing.shared_memory block each step. The unordered pair space is cut
+    into tiles that are dealt out to the workers; each worker accumulates into its
+    own partial (kinds, N, 3) buffer in shared memory and the partial buffers are
+    summed here. Results match the direct sum in Vectorised_Particle_Group.
+    """
+    def __init__(self, processes=None, tile_size=256):
+        self.processes = processes or cpu_count()
+        self.tile_size = tile_size
+        self.n = None
+        self._pool = None
+        self._memory = ()
+        self._finalizer = None
+
+    def __deepcopy__(self, memo):
+        # Pools and shared memory can't be copied; the copy starts its own when first used
+        return Parallel_Pair_Solver(self.processes, self.tile_size)
+
+    def _start(self, n):
+        self.close()
+        self.n = n
+        input_shm = SharedMemory(create=True, size=max(8 * n * 8, 1))
+        partial_shm = SharedMemory(create=True, size=max(self.processes * len(KINDS) * n * 3 * 8, 1))
+        self._memory = (input_shm, partial_shm)
+        self._inputs = np.ndarray((8, n), dtype=float, buffer=input_shm.buf)
+        self._partial = np.ndarray((self.processes, len(KINDS), n, 3), dtype=float, buffer=partial_shm.buf)
+
+        self._pool = Pool(self.processes, initializer=_attach,
+                          initargs=(input_shm.name, partial_shm.name, n, self.processes))
+        self._finalizer = weakref.finalize(self, _release, self._pool, self._memory)
+        self._tasks = self._deal_tiles(n)
+
+    def _deal_tiles(self, n):
+        edges = list(range(0, n, self.tile_size)) + [n]
+        blocks = list(zip(edges[:-1], edges[1:]))
+        tiles = [(i0, i1, j0, j1) for a, (i0, i1) in enumerate(blocks) for (j0, j1) in blocks[a:]]
+        return [tiles[slot::self.processes] for slot in range(self.processes)]
+
+    def close(self):
+        """Stop the worker pool and free the shared memory"""
+        if self._finalizer is not None:
+            self._finalizer()
+        self._pool = None
+        self._memory = ()
+        self._finalizer = None
+        self.n = None
+
+    def build(self, pos, charge, mass, vel):
+        if self._pool is None or self.n != len(pos):
+            self._start(len(pos))
+        self._inputs[0:3] = pos.T
+        self._inputs[3:6] = vel.T
+        self._inputs[6] = charge
+        self._inputs[7] = mass
+        self._sums = {}
+
+    def source_sums(self, kinds):
+        missing = [kind for kind in kinds if kind not in self._sums]
+        if missing:
+            tasks = [(slot, tiles, missing) for slot, tiles in enumerate(self._tasks) if tiles]
+            slots = self._pool.map(_run_tiles, tasks)
+            for kind in missing:
+                k = KINDS.index(kind)
+                self._sums[kind] = self._partial[slots, k].sum(axis=0)
+        return {kind: self._sums[kind] for kind in kinds}
@@ -1,13 +1,22 @@
 from vpython import *
+import numpy as np
+from Neighbour_manager import Neighbour_List, Spatial_Hash
+from Storage_manager import Trajectory, Mapped_Trajectory, Storage_Directory, Trajectory_View, ENCODINGS, encode_trajectory
+
+# Field constants shared by the pairwise and vectorised kernels
+COULOMB_K = 8.99e9
+GRAVITY_G = 6.67e-11
+MAGNETIC_K = 1e-7
 
 class Particle:
-    def __init__(self, charge, mass, initial_position, initial_velocity, initial_acceleration, radius, colour):
+    def __init__(self, charge, mass, initial_position, initial_velocity, initial_acceleration, radius, colour,
+                 is_test_particle=False):
         self.initial_pos = initial_position
         self.pos = self.initial_pos
         self.radius = radius
         self.colour = colour
         self.make_trail = False
-        #self.is_test_particle
+        self.is_test_particle = is_test_particle  # Feels the fields of other particles but sources none
         
         self.trail_type = "points"
         self.interval = 20
@@ -36,6 +45,7 @@ class Particle:
             "Acceleration": self.acceleration,
             "Radius": self.radius,
             "Colour": self.colour,
+            "Test_Particle": self.is_test_particle,
         }
 
     def generate(self):
@@ -61,6 +71,10 @@ class Particle:
     def update_obj_position(self):
         self.object.pos = self.pos
 
+    def show_at(self, pos):
+        # Move only the sphere, so playback never touches the state a running computation is using
+        self.object.pos = pos
+
     def is_clicked(self, click_pos):
         return mag(self.pos - click_pos) <= self.radius
 
@@ -97,69 +111,400 @@ class Particle:
         scene.bind("mouseup", lambda evt: self.handle_mouse_up(self))
 
 
+class Collision_Log:
+    """Columnar record of every collision in a run.
+
+    Each column lives in a preallocated NumPy buffer that doubles in size when it
+    fills up, so recording a frame's collisions is a few slice assignments.
+        step            integration step the collision happened in; recorded frame f is step
+                        f * output_stride, so the log doesn't depend on the output stride
+        first, second   particle indices, first < second
+        normal          unit vector from the first particle to the second
+        relative_speed  closing speed along the normal before the collision
+        impulse         size of the momentum change of the first particle
+    """
+    COLUMNS = {"step": (int, ()), "first": (int, ()), "second": (int, ()),
+               "normal": (float, (3,)), "relative_speed": (float, ()), "impulse": (float, ())}
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self._buffers = {name: np.empty((capacity,) + shape, dtype=dtype) for name, (dtype, shape) in self.COLUMNS.items()}
+
+    def __len__(self):
+        return self.size
+
+    def record(self, step, first, second, normal, relative_speed, impulse):
+        """Append a batch of collisions; every argument but step has one entry per collision"""
+        columns = {"first": first, "second": second, "normal": normal,
+                   "relative_speed": relative_speed, "impulse": impulse}
+        count = len(first)
+        if self.size + count > len(self._buffers["step"]):
+            capacity = max(2 * len(self._buffers["step"]), self.size + count)
+            for name, buffer in self._buffers.items():
+                grown = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+                grown[:self.size] = buffer[:self.size]
+                self._buffers[name] = grown
+        end = self.size + count
+        self._buffers["step"][self.size:end] = step
+        for name, values in columns.items():
+            self._buffers[name][self.size:end] = values
+        self.size = end
+
+    def column(self, name):
+        return self._buffers[name][:self.size]
+
+    def clear(self):
+        self.size = 0
+
+    def truncate(self, step):
+        """Forget the collisions from step onwards; they are recorded in step order"""
+        self.size = int(np.count_nonzero(self.column("step") < step))
+
+    def to_dict(self):
+        return {name: self.column(name).tolist() for name in self.COLUMNS}
+
+    @classmethod
+    def from_dict(cls, columns):
+        steps = columns["step"] if "step" in columns else columns["frame"]  # Logs saved before the rename
+        log = cls(max(len(steps), 1))
+        log.record(np.asarray(steps, dtype=int), columns["first"], columns["second"], np.asarray(columns["normal"], dtype=float).reshape(-1, 3),
+                   columns["relative_speed"], columns["impulse"])
+        return log
+
+
 class SimulationState:
-    def __init__(self, par_desc):
+    def __init__(self, par_desc, dtype=np.float64, storage="memory", storage_dir=None, profile="full"):
         self.particles = par_desc
         self.initial_conditions = [particle.get_desc() for particle in par_desc]
         self.sim_name = None
         self.sim_rate = None
         self.sim_increment = None
         self.sim_duration = None
+        self.integrator = "euler"  # Key into Integrator_manager.INTEGRATORS
+        self.collision_log = Collision_Log()
+        self.output_stride = 1  # Integration steps per recorded frame
+        self.record_aggregates = False  # Also keep min/max/mean over each frame's steps
+        self.aggregates = {}  # channel -> {"min"|"max"|"mean": Trajectory}, filled when record_aggregates is set
+        self.steps = 0  # Integration steps seen by add_step
+        self._window = {}  # Running min/max/sum of each channel since the last recorded frame
+        self.checkpoint_every = None  # Recorded frames between full-state checkpoints
+        self.keep_frames = True  # False keeps only the checkpoints, and playback recomputes frames from them
+        self.checkpoints = {}  # Recorded frame index -> Sim.get_state() snapshot
+        self.latest_frame = None  # (pos, vel, acc) of the last recorded frame when frames aren't kept
         
-        self.pos_data = [[] for _ in par_desc]
-        self.vel_data = [[] for _ in par_desc]
-        self.acc_data = [[] for _ in par_desc]
 
-    def build(self, sim_name, rate, increment, duration):
+        # Trajectories live in (frames, N, 3) arrays; pos_data etc. are list-style views onto them
+        # Frame f of acc is the field acceleration at the positions and velocities of frame f, whatever the integrator
+        self.dtype = np.dtype(dtype)  # float64, or float32 to halve the memory use
+        # "memmap" spills the arrays to files in storage_dir, by default a temporary directory
+        # that is removed once the store and its trajectories are gone
+        if storage not in ("memory", "memmap"):
+            raise ValueError(f"Unknown trajectory storage: {storage}")
+        self.storage = storage
+        self.storage_dir = storage_dir
+        if storage == "memmap" and storage_dir is None:
+            self.storage_dir = Storage_Directory()
+        # "primary" stores positions and velocities only; the accelerations are derived from them when read
+        if profile not in ("full", "primary"):
+            raise ValueError(f"Unknown storage profile: {profile}")
+        self.profile = profile
+        channels = ("pos", "vel", "acc") if profile == "full" else ("pos", "vel")
+        self.trajectories = {channel: self._new_trajectory() for channel in channels}
+        self.derived = {}  # channel -> object recomputing it, e.g. Ensemble_manager.Derived_Acceleration
+        self.fields = None  # (E, M, G) the run was computed with, set by Sim
+        self.encoding = "float64"  # How files and the database save the trajectories, see set_encoding
+        self.error_bound = None
+
+    pos_data = property(lambda self: Trajectory_View(self.channel("pos")),
+                        lambda self, data: self.set_pos_data(data))
+    vel_data = property(lambda self: Trajectory_View(self.channel("vel")),
+                        lambda self, data: self.set_vel_data(data))
+    acc_data = property(lambda self: Trajectory_View(self.channel("acc")),
+                        lambda self, data: self.set_acc_data(data))
+
+    def set_encoding(self, encoding, error_bound=None):
+        """Save trajectories as "float64", "float32", "delta" or "quantized" (within error_bound), see
+        Storage_manager.encode_trajectory; loading decodes any of them"""
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown trajectory encoding: {encoding}")
+        if encoding == "quantized" and not (error_bound and error_bound > 0):
+            raise ValueError("Quantized encoding needs a positive error bound")
+        self.encoding = encoding
+        self.error_bound = error_bound
+
+    def encoded_channel(self, name):
+        """One saved payload per particle in the chosen encoding, or plain [x, y, z] lists for float64"""
+        if self.encoding == "float64":
+            return Trajectory_View(self.channel(name)).tolist()
+        return encode_trajectory(self.channel(name), self.encoding, self.error_bound)
+
+    def channel(self, name):
+        """The stored Trajectory for a channel, or the object deriving it"""
+        if not self.keep_frames and self.recorded_frames > 1:
+            # The arrays only hold frame 0, which would pass for a one-frame run
+            raise ValueError("Only checkpoints are kept for this run (see set_checkpoints), "
+                             "so its frames have to be recomputed through the Sim")
+        if name in self.trajectories:
+            return self.trajectories[name]
+        if name not in self.derived:
+            raise KeyError(f"The {name} channel isn't stored and nothing has been set up to derive it")
+        return self.derived[name]
+
+    def build(self, sim_name, rate, increment, duration, integrator=None):
         self.sim_name = sim_name
         self.sim_rate = rate
         self.sim_increment = increment
         self.sim_duration = duration
+        if integrator is not None:
+            self.integrator = integrator
+
+        self._reserve_frames()
 
         for i in range(len(self.particles)):
             self.add_to_pos(i, self.particles[i].pos)
             self.add_to_vel(i, self.particles[i].velocity)
 
+    @property
+    def output_interval(self):
+        """Simulated time between recorded frames"""
+        return self.sim_increment * self.output_stride
+
+    def set_output_stride(self, stride, aggregates=False):
+        """Record every stride-th integration step, optionally with the min/max/mean of the steps in between"""
+        if int(stride) < 1:
+            raise ValueError("The output stride must be a positive number of steps")
+        self.output_stride = int(stride)
+        self.record_aggregates = aggregates
+        self.aggregates = {channel: {stat: self._new_trajectory() for stat in ("min", "max", "mean")}
+                           for channel in self.trajectories} if aggregates else {}
+        if self.sim_duration is not None:
+            self._reserve_frames()
+
+    @property
+    def records_next_step(self):
+        """True when the next add_step is recorded as a frame or goes into the aggregates"""
+        return self.record_aggregates or (self.steps + 1) % self.output_stride == 0
+
+    def set_checkpoints(self, every, keep_frames=True):
+        """Save a full-state checkpoint every `every` recorded frames, and optionally stop keeping the frames themselves"""
+        if every is not None and int(every) < 1:
+            raise ValueError("Checkpoints must be at least one frame apart")
+        if not keep_frames and every is None:
+            raise ValueError("Frames can only be dropped when checkpoints are saved")
+        self.checkpoint_every = None if every is None else int(every)
+        self.keep_frames = keep_frames
+
+    @property
+    def recorded_frames(self):
+        """Number of frames recorded so far, whether or not they are kept"""
+        if self.keep_frames:
+            return min(trajectory.frames for trajectory in self.trajectories.values())
+        return self.steps // self.output_stride + 1
+
+    def rewind(self, steps):
+        """Drop everything recorded after the given number of integration steps, e.g. to resume from a checkpoint"""
+        self.steps = steps
+        self._window = {}
+        frames = steps // self.output_stride
+        for trajectory in self.trajectories.values():
+            trajectory.truncate(frames + 1)
+        for derived in self.derived.values():
+            derived.clear()
+        for stats in self.aggregates.values():
+            for trajectory in stats.values():
+                trajectory.truncate(frames)
+        self.collision_log.truncate(steps)
+        self.checkpoints = {frame: state for frame, state in self.checkpoints.items() if frame <= frames}
+
+    def _reserve_frames(self):
+        # The initial state plus one frame per output stride, with one to spare for rounding in the step count
+        expected = int(self.sim_duration / self.sim_increment) // self.output_stride + 2
+        for trajectory in self.trajectories.values():
+            trajectory.expected_frames = expected
+        for stats in self.aggregates.values():
+            for trajectory in stats.values():
+                trajectory.expected_frames = expected
+
+    def _new_trajectory(self, expected_frames=0):
+        if self.storage == "memmap":
+            return Mapped_Trajectory(len(self.particles), self.storage_dir, self.dtype, expected_frames)
+        return Trajectory(len(self.particles), self.dtype, expected_frames)
+
+    def _load_channel(self, channel, data):
+        if channel not in self.trajectories:
+            return  # Derived channels are recomputed instead
+        trajectory = self._new_trajectory(self.trajectories[channel].expected_frames)
+        trajectory.load(data)
+        self.trajectories[channel] = trajectory
+
     def set_pos_data(self, new_pos_data):
-        self.pos_data = new_pos_data
+        self._load_channel("pos", new_pos_data)
 
     def set_vel_data(self, new_vel_data):
-        self.vel_data = new_vel_data
+        self._load_channel("vel", new_vel_data)
 
     def set_acc_data(self, new_acc_data):
-        self.acc_data = new_acc_data
+        self._load_channel("acc", new_acc_data)
 
     def add_to_pos(self, par_index, data):
-        self.pos_data[par_index].append(data)
+        self.trajectories["pos"].append(par_index, data)
 
     def add_to_vel(self, par_index, data):
-        self.vel_data[par_index].append(data)
+        self.trajectories["vel"].append(par_index, data)
 
     def add_to_acc(self, par_index, data):
-        self.acc_data[par_index].append(data)
+        if "acc" in self.trajectories:
+            self.trajectories["acc"].append(par_index, data)
+
+    def frame_vectors(self, channel, frame):
+        """Every particle's value at one frame, read from a single (N, 3) row of the trajectory"""
+        return [vector(*xyz) for xyz in self.channel(channel).frame(frame).tolist()]
+
+    def add_frame(self, pos=None, vel=None, acc=None):
+        """Append (N, 3) arrays for every particle at once"""
+        for channel, values in (("pos", pos), ("vel", vel), ("acc", acc)):
+            if values is not None and channel in self.trajectories:
+                self.trajectories[channel].append_frame(values)
+
+    def add_step(self, pos, vel, acc):
+        """Take one integration step's (N, 3) arrays, acc being the field acceleration at that step's pos and vel;
+        every output_stride-th step is recorded as a frame. Returns the index of the recorded frame, or None."""
+        self.steps += 1
+        if self.record_aggregates:
+            for channel, values in (("pos", pos), ("vel", vel), ("acc", acc)):
+                if channel not in self.aggregates:
+                    continue
+                if channel not in self._window:
+                    self._window[channel] = [values.copy(), values.copy(), values.astype(float)]
+                else:
+                    low, high, total = self._window[channel]
+                    np.minimum(low, values, out=low)
+                    np.maximum(high, values, out=high)
+                    total += values
+
+        if self.steps % self.output_stride:
+            return None
+        if self.keep_frames:
+            self.add_frame(pos=pos, vel=vel, acc=acc)
+        else:
+            self.latest_frame = (pos.copy(), vel.copy(), acc.copy())
+        if self.record_aggregates:
+            for channel, (low, high, total) in self._window.items():
+                stats = self.aggregates[channel]
+                stats["min"].append_frame(low)
+                stats["max"].append_frame(high)
+                stats["mean"].append_frame(total / self.output_stride)
+            self._window = {}
+        return self.steps // self.output_stride
 
 class Particle_Group:
     def __init__(self, list_particle_objs):
         self.array_particles = list_particle_objs
         self.array_size = len(self.array_particles)
-        self.particle_pairs = self._calc_par_pairs()
+        self.particle_pairs, self.test_pairs = self._calc_par_pairs()
         self.precomputed_pairs = []  # Store precomputed values for reuse
+        self.precomputed_test_pairs = []  # The same for (source, test particle) pairs
+        self._kernels = {}  # Fused interaction kernels keyed by (E, M, G)
+        self.neighbour_list = None  # Set by set_cutoff() to limit interactions to nearby pairs
+        self.spatial_hash = Spatial_Hash()  # Collision broad phase
         self._precompute_pair_data()
 
     def _calc_par_pairs(self):
-        return [(self.array_particles[i], self.array_particles[j]) for i in range(self.array_size) for j in range(i + 1, self.array_size)]
+        """Pairs of source particles, and (source, test particle) pairs; test particles never pair with each other"""
+        sources = [p for p in self.array_particles if not p.is_test_particle]
+        tests = [p for p in self.array_particles if p.is_test_particle]
+        source_pairs = [(sources[i], sources[j]) for i in range(len(sources)) for j in range(i + 1, len(sources))]
+        test_pairs = [(source, test) for source in sources for test in tests]
+        return source_pairs, test_pairs
+
+    def _split_pairs(self, pairs):
+        # Same split as _calc_par_pairs for an arbitrary list of pairs
+        source_pairs, test_pairs = [], []
+        for p1, p2 in pairs:
+            if not p1.is_test_particle and not p2.is_test_particle:
+                source_pairs.append((p1, p2))
+            elif not p1.is_test_particle:
+                test_pairs.append((p1, p2))
+            elif not p2.is_test_particle:
+                test_pairs.append((p2, p1))
+        return source_pairs, test_pairs
+
+    def set_cutoff(self, cutoff, skin=None):
+        """Only let pairs closer than cutoff interact, found through a Verlet neighbour list"""
+        self.neighbour_list = Neighbour_List(cutoff, skin) if cutoff is not None else None
+        self._neighbour_version = None
+        self._precompute_pair_data()
+
+    def positions(self):
+        return np.array([[p.pos.x, p.pos.y, p.pos.z] for p in self.array_particles], dtype=float).reshape(-1, 3)
+
+    def velocities(self):
+        return np.array([[p.velocity.x, p.velocity.y, p.velocity.z] for p in self.array_particles], dtype=float).reshape(-1, 3)
+
+    def set_motion(self, pos, vel, indices=None):
+        """Overwrite every particle's position and velocity from (N,3) arrays, or only those of the given indices"""
+        particles = self.array_particles if indices is None else [self.array_particles[i] for i in indices]
+        for particle, x, v in zip(particles, pos, vel):
+            particle.pos = vector(*x)
+            particle.velocity = vector(*v)
+
+    def _neighbour_pairs(self):
+        """(source pairs, test pairs) from the neighbour list, refreshed only when the list is rebuilt"""
+        self.neighbour_list.update(self.positions())
+        if self._neighbour_version != self.neighbour_list.version:
+            particles = self.array_particles
+            self._neighbour_particle_pairs = self._split_pairs([(particles[i], particles[j]) for i, j in self.neighbour_list.pairs])
+            self._neighbour_version = self.neighbour_list.version
+        return self._neighbour_particle_pairs
+
+    def radii(self):
+        return np.array([p.radius for p in self.array_particles], dtype=float)
+
+    def source_indices(self):
+        """Indices of the particles that aren't test particles"""
+        return np.array([i for i, p in enumerate(self.array_particles) if not p.is_test_particle], dtype=int)
+
+    def collision_pairs(self):
+        """(i, j) index pairs, i < j, that could be in contact this step, for the narrow-phase
+        sphere test. Test particles pass through everything."""
+        radius = self.radii()
+        sources = self.source_indices()
+        # The Verlet list only guarantees the pairs inside the cutoff, since pairs beyond cutoff + skin
+        # at the last build can have closed in by up to the skin since
+        if self.neighbour_list is not None:
+            if 2 * np.max(radius, initial=0.0) <= self.neighbour_list.cutoff:
+                pairs = self.neighbour_list.update(self.positions())
+                is_source = np.zeros(self.array_size, dtype=bool)
+                is_source[sources] = True
+                return pairs[is_source[pairs].all(axis=1)]
+
+        pairs = self.spatial_hash.update(self.positions()[sources], radius[sources])
+        return sources[pairs]
     
     def _precompute_pair_data(self):
         """Precompute r_vec and direction for all pairs once per timestep"""
+        if self.neighbour_list is not None:
+            source_pairs, test_pairs = self._neighbour_pairs()
+            cutoff = self.neighbour_list.cutoff
+        else:
+            source_pairs, test_pairs = self.particle_pairs, self.test_pairs
+            cutoff = None
+        self.precomputed_pairs = self._pair_data(source_pairs, cutoff)
+        self.precomputed_test_pairs = self._pair_data(test_pairs, cutoff)
+
+    def _pair_data(self, pairs, cutoff):
         epsilon = 1e-9
-        self.precomputed_pairs = []
-        for i, j in self.particle_pairs:
+        pair_data = []
+        for i, j in pairs:
             p1 = i
             p2 = j
             r_vec = p1.pos - p2.pos
             r = mag(r_vec) + epsilon
+            if cutoff is not None and r > cutoff:
+                continue
             direction = r_vec / r
-            self.precomputed_pairs.append( (i, j, r_vec, r, direction) )
+            pair_data.append( (i, j, r_vec, r, direction) )
+        return pair_data
 
     def resetAccelerations(self):
         for p in self.array_particles:
@@ -171,13 +516,17 @@ class Particle_Group:
             force = (k * p1.charge * p2.charge) / r**2 * dir
             p1.acceleration += force / p1.mass
             p2.acceleration -= force / p2.mass
+        for source, test, r_vec, r, dir in self.precomputed_test_pairs:
+            test.acceleration -= (k * source.charge * test.charge) / r**2 * dir / test.mass
 
     def G_Acceleration_Update(self):
         G = 6.67e-11
         for p1, p2, r_vec, r, dir in self.precomputed_pairs:
             force = (G * p1.mass * p2.mass) / r**2 * -dir
             p1.acceleration += force / p1.mass
-            p2.acceleration += force / p2.mass
+            p2.acceleration -= force / p2.mass
+        for source, test, r_vec, r, dir in self.precomputed_test_pairs:
+            test.acceleration += (G * source.mass) / r**2 * dir
 
     def M_Acceleration_Update(self):
         k = 1e-7
@@ -193,4 +542,295 @@ class Particle_Group:
             # Force on p1 from p2's field (reciprocal)
             B_recip = (k * p2.charge * cross(p2.velocity, -dir)) / r**2
             force_p1 = p1.charge * cross(p1.velocity, B_recip)
-            p1.acceleration += force_p1 / p1.mass
\ No newline at end of file
+            p1.acceleration += force_p1 / p1.mass
+
+        # Test particles only feel the field, they don't source one
+        for source, test, r_vec, r, dir in self.precomputed_test_pairs:
+            B = (k * source.charge * cross(source.velocity, dir)) / r**2
+            test.acceleration += test.charge * cross(test.velocity, B) / test.mass
+
+    def interaction_kernel(self, E, M, G):
+        """Single-pass kernel applying every enabled field, cached per field combination"""
+        key = (bool(E), bool(M), bool(G))
+        if key not in self._kernels:
+            self._kernels[key] = self._make_kernel(*key)
+        return self._kernels[key]
+
+    def _make_kernel(self, E, M, G):
+        # Coulomb and gravity both act along the pair axis, so they share one force vector:
+        # F = (k q1 q2 - G m1 m2) / r^2 * dir
+        k_E = COULOMB_K if E else 0.0
+        g = GRAVITY_G if G else 0.0
+        k_M = MAGNETIC_K
+
+        def radial_kernel():
+            for p1, p2, r_vec, r, dir in self.precomputed_pairs:
+                force = (k_E * p1.charge * p2.charge - g * p1.mass * p2.mass) / r**2 * dir
+                p1.acceleration += force / p1.mass
+                p2.acceleration -= force / p2.mass
+
+        def magnetic_kernel():
+            for p1, p2, r_vec, r, dir in self.precomputed_pairs:
+                inv_r2 = 1 / r**2
+                B = (k_M * p1.charge * inv_r2) * cross(p1.velocity, dir)
+                p2.acceleration += p2.charge * cross(p2.velocity, B) / p2.mass
+                B_recip = (k_M * p2.charge * inv_r2) * cross(p2.velocity, -dir)
+                p1.acceleration += p1.charge * cross(p1.velocity, B_recip) / p1.mass
+
+        def full_kernel():
+            for p1, p2, r_vec, r, dir in self.precomputed_pairs:
+                inv_r2 = 1 / r**2
+                force = (k_E * p1.charge * p2.charge - g * p1.mass * p2.mass) * inv_r2 * dir
+                B = (k_M * p1.charge * inv_r2) * cross(p1.velocity, dir)
+                B_recip = (k_M * p2.charge * inv_r2) * cross(p2.velocity, -dir)
+                p1.acceleration += (force + p1.charge * cross(p1.velocity, B_recip)) / p1.mass
+                p2.acceleration += (p2.charge * cross(p2.velocity, B) - force) / p2.mass
+
+        # Test particles feel the source particles' fields without acting back on them
+        def radial_test_kernel():
+            for source, test, r_vec, r, dir in self.precomputed_test_pairs:
+                test.acceleration -= (k_E * source.charge * test.charge - g * source.mass * test.mass) / r**2 * dir / test.mass
+
+        def magnetic_test_kernel():
+            for source, test, r_vec, r, dir in self.precomputed_test_pairs:
+                B = (k_M * source.charge / r**2) * cross(source.velocity, dir)
+                test.acceleration += test.charge * cross(test.velocity, B) / test.mass
+
+        def full_test_kernel():
+            for source, test, r_vec, r, dir in self.precomputed_test_pairs:
+                inv_r2 = 1 / r**2
+                force = (k_E * source.charge * test.charge - g * source.mass * test.mass) * inv_r2 * dir
+                B = (k_M * source.charge * inv_r2) * cross(source.velocity, dir)
+                test.acceleration += (test.charge * cross(test.velocity, B) - force) / test.mass
+
+        if M and (E or G):
+            source_kernel, test_kernel = full_kernel, full_test_kernel
+        elif M:
+            source_kernel, test_kernel = magnetic_kernel, magnetic_test_kernel
+        elif E or G:
+            source_kernel, test_kernel = radial_kernel, radial_test_kernel
+        else:
+            return lambda: None
+
+        def kernel():
+            source_kernel()
+            if self.precomputed_test_pairs:
+                test_kernel()
+        return kernel
+
+    def advance(self, dt):
+        """Semi-implicit Euler step for every particle"""
+        for particle in self.array_particles:
+            particle.velocity += particle.acceleration * dt
+            particle.pos += particle.velocity * dt
+
+    def state_vectors(self):
+        """Yield (position, velocity, acceleration) vectors for each particle"""
+        for particle in self.array_particles:
+            yield particle.pos, particle.velocity, particle.acceleration
+
+    def state_arrays(self):
+        """(N, 3) position, velocity and acceleration arrays"""
+        acc = np.array([[p.acceleration.x, p.acceleration.y, p.acceleration.z] for p in self.array_particles], dtype=float)
+        return self.positions(), self.velocities(), acc.reshape(-1, 3)
+
+    def set_state_arrays(self, pos, vel, acc):
+        """Overwrite every particle's position, velocity and acceleration, the inverse of state_arrays()"""
+        self.set_motion(pos, vel)
+        for particle, a in zip(self.array_particles, acc):
+            particle.acceleration = vector(*a)
+
+    def sync_to_particles(self):
+        # Particle objects already hold the live state
+        pass
+
+    def load_from_particles(self):
+        pass
+
+
+class Vectorised_Particle_Group(Particle_Group):
+    """Particle_Group holding the particle state as contiguous (N,3)/(N,) float arrays.
+
+    The Particle objects are only written to when sync_to_particles() is called,
+    e.g. for rendering; collisions work on the arrays directly.
+    """
+    def __init__(self, list_particle_objs, field_solver=None, chunk_size=256):
+        self.array_particles = list_particle_objs
+        self.array_size = len(self.array_particles)
+        self.particle_pairs, self.test_pairs = self._calc_par_pairs()
+        self.field_solver = field_solver  # e.g. Barnes_Hut_Solver, Particle_Mesh_Solver, None for direct sums
+        self.chunk_size = chunk_size  # Target rows per block of the direct sum
+        self.load_from_particles()
+        self.precomputed_pairs = []
+        self._kernels = {}
+        self.neighbour_list = None
+        self.spatial_hash = Spatial_Hash()
+        self._precompute_pair_data()
+
+    def load_from_particles(self):
+        """Copy the Particle objects' state into the arrays"""
+        particles = self.array_particles
+        self.pos = np.array([[p.pos.x, p.pos.y, p.pos.z] for p in particles], dtype=float).reshape(-1, 3)
+        self.vel = np.array([[p.velocity.x, p.velocity.y, p.velocity.z] for p in particles], dtype=float).reshape(-1, 3)
+        self.acc = np.array([[p.acceleration.x, p.acceleration.y, p.acceleration.z] for p in particles], dtype=float).reshape(-1, 3)
+        self.charge = np.array([p.charge for p in particles], dtype=float)
+        self.mass = np.array([p.mass for p in particles], dtype=float)
+        self.radius = np.array([p.radius for p in particles], dtype=float)
+        self.is_test = np.array([p.is_test_particle for p in particles], dtype=bool)
+        self.sources = np.nonzero(~self.is_test)[0]  # Indices of the particles that source fields
+
+    def sync_to_particles(self):
+        """Write the array state back to the Particle objects"""
+        for i, particle in enumerate(self.array_particles):
+            particle.pos = vector(*self.pos[i])
+            particle.velocity = vector(*self.vel[i])
+            particle.acceleration = vector(*self.acc[i])
+
+    def positions(self):
+        return self.pos
+
+    def velocities(self):
+        return self.vel
+
+    def radii(self):
+        return self.radius
+
+    def source_indices(self):
+        return self.sources
+
+    def set_motion(self, pos, vel, indices=None):
+        if indices is None:
+            indices = slice(None)
+        self.pos[indices] = pos
+        self.vel[indices] = vel
+
+    def set_state_arrays(self, pos, vel, acc):
+        self.set_motion(pos, vel)
+        self.acc[:] = acc
+
+    def _precompute_pair_data(self):
+        # The direct sum works block by block in _field_sums, so only a solver or neighbour list needs refreshing
+        if self.field_solver is not None:
+            # Test particles are given no charge or mass, so they drop out of the solver's fields
+            source = ~self.is_test
+            self.field_solver.build(self.pos, self.charge * source, self.mass * source, self.vel)
+        elif self.neighbour_list is not None:
+            self.neighbour_list.update(self.pos)
+
+    def _neighbour_sums(self, kinds):
+        """Source sums over the neighbour pairs inside the cutoff, applying each pair to both ends"""
+        epsilon = 1e-9
+        i, j = self.neighbour_list.pairs.T
+        disp = self.pos[j] - self.pos[i]
+        r = np.sqrt(np.einsum("ij,ij->i", disp, disp)) + epsilon
+        inside = (r <= self.neighbour_list.cutoff) & ~(self.is_test[i] & self.is_test[j])
+        i, j, disp = i[inside], j[inside], disp[inside]
+        scaled = disp / r[inside, np.newaxis]**3
+
+        # Zero weights for test particles, so a (source, test) pair only acts on the test particle
+        source = ~self.is_test
+        sums = {kind: np.zeros((self.array_size, 3)) for kind in kinds}
+        for kind in kinds:
+            if kind == "current":
+                moment = (self.charge * source)[:, np.newaxis] * self.vel
+                np.add.at(sums[kind], i, np.cross(moment[j], scaled))
+                np.add.at(sums[kind], j, -np.cross(moment[i], scaled))
+            else:
+                w = (self.charge if kind == "charge" else self.mass) * source
+                np.add.at(sums[kind], i, w[j, np.newaxis] * scaled)
+                np.add.at(sums[kind], j, -w[i, np.newaxis] * scaled)
+        return sums
+
+    def _field_sums(self, kinds, targets=None):
+        """Source sums for several kinds at once, with the convention d_ij = pos_j - pos_i:
+            "charge":  sum_j q_j d_ij / r^3
+            "mass":    sum_j m_j d_ij / r^3
+            "current": sum_j (q_j v_j) x d_ij / r^3
+        The direct sum shares one displacement and 1/r^3 block between all kinds,
+        and only runs over the source particles j, so test particles cost
+        O(N_source) each. Only the rows for the target indices are returned when
+        targets is given.
+        """
+        if targets is None:
+            targets = np.arange(self.array_size)
+        if self.field_solver is not None:
+            sums = self.field_solver.source_sums(kinds)
+            return {kind: sums[kind][targets] for kind in kinds}
+        if self.neighbour_list is not None:
+            sums = self._neighbour_sums(kinds)
+            return {kind: sums[kind][targets] for kind in kinds}
+
+        epsilon = 1e-9
+        n = len(targets)
+        scalar_kinds = [kind for kind in kinds if kind != "current"]
+        sources = self.sources
+        weights = np.stack([self.charge[sources] if kind == "charge" else self.mass[sources] for kind in scalar_kinds], axis=1) if scalar_kinds else None
+        moment = self.charge[sources, np.newaxis] * self.vel[sources]
+        source_pos = self.pos[sources]
+        sums = {kind: np.zeros((n, 3)) for kind in kinds}
+
+        for start in range(0, n, self.chunk_size):
+            stop = min(start + self.chunk_size, n)
+            disp = source_pos[np.newaxis, :, :] - self.pos[targets[start:stop], np.newaxis, :]
+            r = np.sqrt(np.einsum("ijk,ijk->ij", disp, disp)) + epsilon
+            inv_r3 = 1.0 / r**3
+            if scalar_kinds:
+                block = np.einsum("ijk,ij,jw->wik", disp, inv_r3, weights)
+                for w, kind in enumerate(scalar_kinds):
+                    sums[kind][start:stop] = block[w]
+            if "current" in kinds:
+                sums["current"][start:stop] = np.einsum("ijk,ij->ik", np.cross(moment[np.newaxis, :, :], disp), inv_r3)
+        return sums
+
+    def _source_sum(self, kind):
+        return self._field_sums((kind,))[kind]
+
+    def resetAccelerations(self):
+        self.acc[:] = 0.0
+
+    def E_Acceleration_Update(self):
+        self.acc -= (COULOMB_K * self.charge / self.mass)[:, np.newaxis] * self._source_sum("charge")
+
+    def G_Acceleration_Update(self):
+        self.acc += GRAVITY_G * self._source_sum("mass")
+
+    def magnetic_field(self):
+        # B_i = k * sum_j q_j (v_j x d_ij) / r^3
+        return MAGNETIC_K * self._source_sum("current")
+
+    def M_Acceleration_Update(self):
+        B = self.magnetic_field()
+        self.acc += (self.charge / self.mass)[:, np.newaxis] * np.cross(self.vel, B)
+
+    def _make_kernel(self, E, M, G):
+        kinds = [kind for kind, on in (("charge", E), ("current", M), ("mass", G)) if on]
+
+        def kernel(targets=None):
+            # targets restricts the update to a subset of particles, e.g. for block time steps
+            if not kinds:
+                return
+            if targets is None:
+                targets = np.arange(self.array_size)
+            sums = self._field_sums(kinds, targets)
+            specific_charge = self.charge[targets] / self.mass[targets]
+            acc = np.zeros((len(targets), 3))
+            if E:
+                acc -= (COULOMB_K * specific_charge)[:, np.newaxis] * sums["charge"]
+            if G:
+                acc += GRAVITY_G * sums["mass"]
+            if M:
+                B = MAGNETIC_K * sums["current"]
+                acc += specific_charge[:, np.newaxis] * np.cross(self.vel[targets], B)
+            self.acc[targets] += acc
+        return kernel
+
+    def advance(self, dt):
+        self.vel += self.acc * dt
+        self.pos += self.vel * dt
+
+    def state_vectors(self):
+        for i in range(self.array_size):
+            yield vector(*self.pos[i]), vector(*self.vel[i]), vector(*self.acc[i])
+
+    def state_arrays(self):
+        return self.pos, self.vel, self.acc
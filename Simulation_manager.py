@@ -2,16 +2,46 @@ from Collision_manager import *
 from Database_manager import *
 from Analysis_manager import *
 from Particle_manager import *
+from Octree_manager import Barnes_Hut_Solver
+from Mesh_manager import Particle_Mesh_Solver
+from Parallel_manager import Parallel_Pair_Solver
+from Integrator_manager import make_integrator
+from Ensemble_manager import Ensemble, attach_derived_channels
 
 from vpython import canvas, button, slider, wtext, rate, vector
 from copy import deepcopy
+import numpy as np
+import threading
 import sys
 
 class Sim(Collision_manager):
-    def __init__(self, SimulationState_obj, e=1, E=True, M=True, G=True):
+    def __init__(self, SimulationState_obj, e=1, E=True, M=True, G=True, vectorised=False,
+                 solver="pairwise", theta=0.5, integrator=None, cutoff=None, skin=None, broad_phase="hash",
+                 ccd=False, output_stride=None, aggregates=False, substeps=None):
         # Initialize the particle group and handle collisions
-        parGroup = Particle_Group(SimulationState_obj.particles)
-        super(Sim, self).__init__(parGroup, e)
+        if integrator is not None:
+            SimulationState_obj.integrator = integrator
+        if output_stride is not None:
+            SimulationState_obj.set_output_stride(output_stride, aggregates)
+        self.integrator = make_integrator(SimulationState_obj.integrator)
+
+        # Field solvers other than the direct pair sum, and higher-order integrators, work on the vectorised arrays
+        self.solver = solver
+        self.theta = theta
+        self.vectorised = vectorised or solver != "pairwise" or self.integrator.needs_arrays
+        if self.vectorised:
+            parGroup = Vectorised_Particle_Group(SimulationState_obj.particles, self._make_field_solver())
+        else:
+            parGroup = Particle_Group(SimulationState_obj.particles)
+        # Optional interaction cutoff, backed by a Verlet neighbour list
+        self.cutoff = cutoff
+        self.skin = skin
+        if cutoff is not None:
+            parGroup.set_cutoff(cutoff, skin)
+        # Each run starts a fresh collision log in the data store
+        SimulationState_obj.collision_log.clear()
+        super(Sim, self).__init__(parGroup, e, broad_phase, SimulationState_obj.collision_log)
+        self.ccd = ccd  # Swept-sphere time-of-impact checks, so fast particles can't tunnel at large dt
         
         # Set up simulation parameters from the data store object
         self.name = SimulationState_obj.sim_name
@@ -36,15 +66,28 @@ class Sim(Collision_manager):
         self.E = E
         self.M = M
         self.G = G
+        self.store.fields = (E, M, G)
+        attach_derived_channels(self.store, getattr(parGroup, "field_solver", None), cutoff, skin)
 
-        # Acceleration update functions
-        self.acc_update_funcs = []
+        # Fused acceleration kernel for the enabled fields
+        self.acc_kernel = None
         self._field_calc()
+        self._acc_ready = False  # True when particle accelerations already match the current state
         self.particles._precompute_pair_data()  # Initial precompute
         
         # Add flag for live updates
         self.live_update = True
 
+        # Background pre_compute thread and the event that cancels it, see start_stream()
+        self._producer = None
+        self._stream_stop = None
+        # Copy of the simulation that recomputes frames from checkpoints, see _replay()
+        self._replayer = None
+        self._replayed = {}  # The last frames it produced
+        # Interpolated playback frames per recorded frame; by default as many as the steps each frame stands for
+        self.substeps = substeps or self.store.output_stride
+        self._sub = 0  # Playback position between iter_count and the next frame, in substeps
+
         # Generate a copy of this simulation for later status updates and comparisons
         self.original_sim = deepcopy(self)
 
@@ -58,7 +101,7 @@ class Sim(Collision_manager):
 
         # Add time slider
         self.time_slider = None
-        self.frames_left = int(self.run_time / self.dt)
+        self.frames_left = int(self.run_time / self.dt) // self.store.output_stride
         self._add_time_slider()
 
         # Add checkboxes for fields
@@ -69,12 +112,27 @@ class Sim(Collision_manager):
         # Bind mouse events in canvas to enable dragging of particles
         self._bind_mouse_events()
 
+    def _make_field_solver(self):
+        # Either a solver name or a configured solver object, e.g. Particle_Mesh_Solver(64, "periodic", box_size=10)
+        if not isinstance(self.solver, str):
+            return self.solver
+        if self.solver == "pairwise":
+            return None
+        if self.solver == "tree":
+            return Barnes_Hut_Solver(theta=self.theta)
+        if self.solver == "mesh":
+            return Particle_Mesh_Solver()
+        if self.solver == "parallel":
+            return Parallel_Pair_Solver()
+        raise ValueError(f"Unknown field solver: {self.solver}")
+
     def _clear_window(self):
         self.scene.delete()
         self.scene.caption = ""
         self.scene.title = ""
 
     def rebuild_simulation(self):
+        self.stop_stream()
         self._clear_window()
         
         orig = self.original_sim
@@ -88,8 +146,10 @@ class Sim(Collision_manager):
             orig.store.pos_data[i] = [particle.initial_pos]
 
 
-        self = Sim(orig.store, E=self.E, M=self.M, G=self.G)
-        self.pre_compute()
+        self = Sim(orig.store, E=self.E, M=self.M, G=self.G, vectorised=self.vectorised,
+                   solver=self.solver, theta=self.theta, cutoff=self.cutoff, skin=self.skin,
+                   broad_phase=self.broad_phase, ccd=self.ccd, substeps=self.substeps)
+        self.start_stream()
         self.Run()
 
     def _check_changes(self):
@@ -204,16 +264,24 @@ class Sim(Collision_manager):
     def update_time(self, s):
         """Update the time frame of the simulation."""
         #if not self.running:  # Only allow manual updates when the simulation is paused
-        self.iter_count = int(s.value)  # Get the slider's current frame value
+        self.iter_count = min(int(s.value), self._playable_frames() - 1)  # Get the slider's current frame value
+        self._sub = 0
         frame = self.iter_count
         self.time_text.text = f"Frame: {frame}"
 
         # Update particle positions for the selected frame
-        particle_index = -1
-        for particle in self.particles.array_particles:
-            particle_index = (particle_index + 1) % self.particles.array_size
-            particle.pos = self.store.pos_data[particle_index][frame]
-            particle.update_obj_position()
+        for particle, pos in zip(self.particles.array_particles, self._frame_vectors("pos", frame)):
+            particle.show_at(pos)
+
+    def _playable_frames(self):
+        """Frames that can be shown; while streaming, only those recorded so far, with the time slider grown to match"""
+        if self._producer is None:
+            return self.frames_left
+        ready = self.store.recorded_frames
+        frames = max(1, min(self.frames_left, ready))
+        if self.time_slider.max != frames:
+            self.time_slider.max = frames
+        return frames
 
     def _add_field_checkboxes(self):
         """Add checkboxes to enable/disable electric, magnetic, and gravitational fields."""
@@ -250,35 +318,49 @@ class Sim(Collision_manager):
 
     def toggle_electric_field(self, evt):
         self.E = evt.checked
-        self._update_acc_update_funcs()
+        self._update_acc_kernel()
         self.live_update = True  # Force recompute
         self._check_changes()
 
     def toggle_magnetic_field(self, evt):
         """Toggle the magnetic field on or off."""
         self.M = evt.checked
-        self._update_acc_update_funcs()
+        self._update_acc_kernel()
         self._check_changes()
 
     def toggle_gravitational_field(self, evt):
         """Toggle the gravitational field on or off."""
         self.G = evt.checked
-        self._update_acc_update_funcs()
+        self._update_acc_kernel()
         self.live_update = True  # Force recompute
         self._check_changes()
 
-    def _update_acc_update_funcs(self):
-        """Rebuild the acceleration update functions list based on enabled fields."""
-        self.acc_update_funcs = []
+    def _update_acc_kernel(self):
+        """Reselect the acceleration kernel based on enabled fields."""
         self._field_calc()
 
     def _field_calc(self):
-        if self.E:
-            self.acc_update_funcs.append(self.particles.E_Acceleration_Update)
-        if self.M:
-            self.acc_update_funcs.append(self.particles.M_Acceleration_Update)
-        if self.G:
-            self.acc_update_funcs.append(self.particles.G_Acceleration_Update)
+        # One fused pass over the pairs for whichever fields are switched on
+        # The Boris pusher applies the magnetic term itself, so the kernel leaves it out
+        if self.integrator.handles_magnetic:
+            self.integrator.magnetic = self.M
+        kernel_M = self.M and not self.integrator.handles_magnetic
+        self.acc_kernel = self.particles.interaction_kernel(self.E, kernel_M, self.G)
+
+    def _evaluate_accelerations(self, targets=None):
+        """Recompute accelerations from the current positions and velocities,
+        for every particle or only the given target indices (vectorised backend)."""
+        if targets is None:
+            self.particles.resetAccelerations()
+        else:
+            self.particles.acc[targets] = 0.0
+        if self.live_update:
+            # Force recompute of particle pairs with latest positions
+            self.particles._precompute_pair_data()
+        if targets is None:
+            self.acc_kernel()
+        else:
+            self.acc_kernel(targets)
 
     def _loadParticles(self):
         count = -1
@@ -287,44 +369,201 @@ class Sim(Collision_manager):
             particle.generate()
 
     def _compute_frame(self):
-        if self.live_update:
-            # Force recompute of particle pairs with latest positions
-            self.particles._precompute_pair_data()
+        if not self._acc_ready:
+            self._evaluate_accelerations()
 
-        for func in self.acc_update_funcs:
-            func()
-
-        self.collisionDetection() 
-        count = -1
+        self._detect_collisions()
         dt = self.dt  # Accessing `self.dt` once outside the loop for efficiency
-        size = self.particles.array_size  # Similarly, pre-fetch size to avoid repeated lookups
-        particles = self.particles.array_particles  # Pre-fetch the particle array
-
-        # Use enumerate to handle count updates and perform operations
-        for count, particle in enumerate(particles):
-            particle.velocity += particle.acceleration * dt
-            particle.pos += particle.velocity * dt
-
-            # Store updated values in one go for each particle
-            self.store.add_to_pos(count % size, particle.pos)
-            self.store.add_to_vel(count % size, particle.velocity)
-            self.store.add_to_acc(count % size, particle.acceleration)
+        start = self.particles.positions().copy() if self.ccd else None
+        self._acc_ready = self.integrator.step(self.particles, dt, self._evaluate_accelerations)
+        if self.ccd and self.continuous_collisions(start, dt):
+            # Impacts part-way through the step changed positions and velocities
+            self._acc_ready = False
+
+        # Accelerations of the new state, which the next step starts from
+        exact = not self._acc_ready or (self.integrator.acc_at_new_state and not self.M)
+        if not self._acc_ready:
+            self._evaluate_accelerations()
+            self._acc_ready = True
+
+        # Hand the step to the store, which records every output_stride-th one;
+        # the accelerations of the steps it skips are never read
+        pos, vel, acc = self.particles.state_arrays()
+        if self.store.records_next_step:
+            acc = self._recorded_acceleration(acc, exact)
+        recorded = self.store.add_step(pos, vel, acc)
 
         self.t += dt
+        self.step += 1
+        every = self.store.checkpoint_every
+        if recorded is not None and every and recorded % every == 0:
+            self.store.checkpoints[recorded] = self.get_state()
+
+    def _recorded_acceleration(self, acc, exact=True):
+        """The field acceleration at the current state, which is what the acc channel holds whatever the integrator.
+        exact=False re-evaluates it instead of using accelerations an integrator left from part-way through its step."""
+        if not exact:
+            pos, vel, kept = (array.copy() for array in self.particles.state_arrays())
+            self._evaluate_accelerations()
+            acc = self.particles.state_arrays()[2].copy()
+            self.particles.set_state_arrays(pos, vel, kept)
+        if self.integrator.handles_magnetic and self.M:
+            # The Boris pusher keeps the magnetic force out of the kernel
+            group = self.particles
+            acc = acc + (group.charge / group.mass)[:, np.newaxis] * np.cross(group.vel, group.magnetic_field())
+        return acc
+
+    def _detect_collisions(self):
+        # Contacts are found and resolved on the group's arrays, so the Particle objects aren't synced here
+        self.collisionDetection()
+
+    def start_stream(self):
+        """Run pre_compute in a background thread, so Run() can play frames back as they are recorded.
+        The thread steps its own copy of the simulation as it was set up, recording into this store,
+        so the sliders and field toggles can't change a run part-way through; Recalculate starts a new one."""
+        producer = self._frozen_copy(self.store)
+        self._stream_stop = threading.Event()
+        self._producer = threading.Thread(target=producer.pre_compute, kwargs={"stop": self._stream_stop}, daemon=True)
+        self._producer.start()
+        self._playable_frames()
+
+    def stop_stream(self):
+        """Cancel a background pre_compute and wait for its thread to end"""
+        if self._producer is not None:
+            self._stream_stop.set()
+            self._producer.join()
+
+    def finish_stream(self):
+        """Wait for a background pre_compute to record every frame"""
+        if self._producer is not None:
+            self._producer.join()
+            self._playable_frames()
+
+    def get_state(self):
+        """Snapshot of everything the run needs to carry on from this step, see set_state()"""
+        pos, vel, acc = self.particles.state_arrays()
+        return {"t": self.t, "step": self.step, "acc_ready": self._acc_ready,
+                "pos": pos.copy(), "vel": vel.copy(), "acc": acc.copy(),
+                "contacts": set(self.contacts), "bounces": self.bounces,
+                "integrator": deepcopy(self.integrator),
+                "neighbour_list": deepcopy(self.particles.neighbour_list),
+                "sweep": deepcopy(self.sweep), "sweep_keys": self.sweep_keys.copy()}
+
+    def set_state(self, state):
+        """Return to a get_state() snapshot, dropping anything recorded after it"""
+        self.t = state["t"]
+        self.step = state["step"]
+        self._acc_ready = state["acc_ready"]
+        self.particles.set_state_arrays(state["pos"], state["vel"], state["acc"])
+        self.contacts = set(state["contacts"])
+        self.bounces = state["bounces"]
+        self.integrator = deepcopy(state["integrator"])
+        self._field_calc()
+        self.particles.neighbour_list = deepcopy(state["neighbour_list"])
+        self.particles._neighbour_version = None
+        self.sweep = deepcopy(state["sweep"])
+        self.sweep_keys = state["sweep_keys"].copy()
+        self.store.rewind(self.step)
+        acc = self._recorded_acceleration(self.particles.state_arrays()[2], exact=False)
+        self.store.latest_frame = (state["pos"].copy(), state["vel"].copy(), acc)
+
+    def pre_compute(self, resume=False, stop=None):
+        """Integrate over the whole duration; resume=True carries on from the latest checkpoint instead of the start.
+        stop is an optional threading.Event that ends the run early once set."""
+        if resume and self.store.checkpoints:
+            self.set_state(self.store.checkpoints[max(self.store.checkpoints)])
+        elif self.store.steps == 0:
+            # Frame 0 was recorded by build() without its accelerations
+            if not self._acc_ready:
+                self._evaluate_accelerations()
+                self._acc_ready = True
+            self.store.add_frame(acc=self._recorded_acceleration(self.particles.state_arrays()[2]))
+            if self.store.checkpoint_every:
+                self.store.checkpoints[0] = self.get_state()
 
-        self.particles.resetAccelerations()
-
-    def pre_compute(self): 
         while self.t < self.run_time: 
+            if stop is not None and stop.is_set():
+                break
             self._compute_frame()
 
-        for func in self.acc_update_funcs: 
-            func()
-
-        count = -1 
-        for particle in self.particles.array_particles:
-            count = (count + 1) % self.particles.array_size 
-            self.store.add_to_acc(count, particle.acceleration)
+        # Release worker processes held by a parallel field solver
+        field_solver = getattr(self.particles, "field_solver", None)
+        if hasattr(field_solver, "close"):
+            field_solver.close()
+
+    def run_ensemble(self, variants):
+        """Run variants of the current setup side by side, see Ensemble_manager.Ensemble"""
+        return Ensemble(self.store, variants, E=self.E, M=self.M, G=self.G).pre_compute()
+
+    def _frame_arrays(self, frame, channels=("pos", "vel", "acc")):
+        """Arrays of the given channels at a recorded frame, recomputed from a checkpoint if frames aren't kept"""
+        if self.store.keep_frames:
+            return tuple(self.store.channel(channel).frame(frame) for channel in channels)
+        arrays = self._replay(frame)
+        return tuple(arrays[("pos", "vel", "acc").index(channel)] for channel in channels)
+
+    def _frame_vectors(self, channel, frame):
+        """Vectors for every particle at a recorded frame"""
+        values, = self._frame_arrays(frame, (channel,))
+        return [vector(*xyz) for xyz in values.tolist()]
+
+    def _interpolated_positions(self, frame, s):
+        """Positions a fraction s of the way from frame to frame + 1, from cubic Hermite
+        interpolation of the recorded positions and velocities at both ends"""
+        pos0, vel0 = self._frame_arrays(frame, ("pos", "vel"))
+        if s == 0:
+            return [vector(*xyz) for xyz in pos0.tolist()]
+        pos1, vel1 = self._frame_arrays(frame + 1, ("pos", "vel"))
+        h = self.store.output_interval
+        s2, s3 = s * s, s * s * s
+        pos = ((2 * s3 - 3 * s2 + 1) * pos0 + (s3 - 2 * s2 + s) * h * vel0
+               + (3 * s2 - 2 * s3) * pos1 + (s3 - s2) * h * vel1)
+        return [vector(*xyz) for xyz in pos.tolist()]
+
+    def _advance_playback(self):
+        """Move playback on by one substep, holding at the last frame recorded so far"""
+        last = self._playable_frames() - 1
+        self._sub += 1
+        if self._sub >= self.substeps:
+            self._sub = 0
+            if self.iter_count < last:
+                self.iter_count += 1
+        if self.iter_count >= last:
+            self._sub = 0
+
+    def _frozen_copy(self, store=None):
+        """Copy of the simulation as it was set up, with its own particles, kernels and integrator.
+        Given a store, the copy records into it instead of into a copy of the original one."""
+        orig = self.original_sim
+        memo = {}
+        if store is not None:
+            memo = {id(orig.store): store, id(orig.collision_log): store.collision_log}
+        copy = deepcopy(orig, memo)
+        copy.particles._kernels = {}  # Kernels are closures over the group they were made for
+        copy._field_calc()
+        return copy
+
+    def _replay(self, frame):
+        """(pos, vel, acc) arrays at a frame, stepping a copy of the simulation on from the nearest earlier checkpoint.
+        Playing forwards frame by frame only takes one more stride of steps each time."""
+        if self._replayer is None:
+            self._replayer = self._frozen_copy()
+            self._replayer.store.set_checkpoints(None)
+            self._replayer.store.keep_frames = False
+        if frame in self._replayed:
+            return self._replayed[frame]
+        replayer = self._replayer
+        stride = self.store.output_stride
+        start = max(f for f in list(self.store.checkpoints) if f <= frame)
+        current = replayer.store.steps // stride if replayer.store.latest_frame is not None else -1
+        if not start <= current <= frame:
+            replayer.set_state(self.store.checkpoints[start])
+        while replayer.store.steps < frame * stride:
+            replayer._compute_frame()
+        # Interpolation asks for each frame along with the next one
+        self._replayed = {f: arrays for f, arrays in self._replayed.items() if f == frame - 1}
+        self._replayed[frame] = replayer.store.latest_frame
+        return replayer.store.latest_frame
 
     def _handle_mouse_down(self):
         for particle in self.particles.array_particles:
@@ -346,36 +585,32 @@ class Sim(Collision_manager):
 
 
     def Run(self):
-        frames_left = int(self.run_time / self.dt)
+        self._loadParticles()
 
         # Initialize all particle positions in a single batch operation
-        initial_positions = [pos[0] for pos in self.store.pos_data]
+        initial_positions = self._frame_vectors("pos", 0)
         for particle, pos in zip(self.particles.array_particles, initial_positions):
-            particle.pos = pos
-
-        self._loadParticles()
+            particle.show_at(pos)
 
         # Start from the slider’s position
         self.iter_count = int(self.time_slider.value) - 1
+        self._sub = self.substeps - 1  # So the first substep lands on that frame
 
         # Main simulation loop
         while True:
             if self.running:  # Run the simulation only if not paused
-                Sim._update_acc_update_funcs(self)
-                rate(self.rate*100)
-                if self.iter_count < (frames_left - 1):
-                    self.iter_count += 1
+                rate(self.rate*100*self.substeps)
+                self._advance_playback()
 
                 # Update the slider's value
                 self.time_slider.value = self.iter_count
 
-                # Batch extraction of frame data
-                frame_pos_data = [pos[self.iter_count] for pos in self.store.pos_data]
+                # Batch extraction of frame data, between recorded frames when playing substeps
+                frame_pos_data = self._interpolated_positions(self.iter_count, self._sub / self.substeps)
 
                 # Batch update of particle positions
                 for particle, pos in zip(self.particles.array_particles, frame_pos_data):
-                    particle.pos = pos
-                    particle.update_obj_position()
+                    particle.show_at(pos)
             else:  # Paused state
                 rate(10)  # Reduce processing frequency to save resources
 
@@ -389,8 +624,11 @@ class Sim(Collision_manager):
 
 class SimulationVisualiser(Sim, PhysicsCalculator):
     # Inherits SIM class and overrides the Run()
-    def __init__(self, SimulationState_obj, e=1, E=True, M=True, G=True, with_minmax=False):
-        super(SimulationVisualiser, self).__init__(SimulationState_obj, e, E, M, G)
+    def __init__(self, SimulationState_obj, e=1, E=True, M=True, G=True, with_minmax=False, vectorised=False,
+                 solver="pairwise", theta=0.5, integrator=None, cutoff=None, skin=None, broad_phase="hash",
+                 ccd=False, output_stride=None, aggregates=False, substeps=None):
+        super(SimulationVisualiser, self).__init__(SimulationState_obj, e, E, M, G, vectorised, solver, theta, integrator,
+                                                   cutoff, skin, broad_phase, ccd, output_stride, aggregates, substeps)
         self.graph_units = PhysicsCalculator().graph_units
         self.var_to_func = PhysicsCalculator().var_to_func
         self.with_minmax = with_minmax
@@ -448,6 +686,7 @@ class SimulationVisualiser(Sim, PhysicsCalculator):
         return "{} /{}".format(att, self.graph_units[att])
     
     def rebuild_simulation(self):
+        self.stop_stream()
         self._clear_window()
         self._clear_graphs()
         
@@ -463,22 +702,26 @@ class SimulationVisualiser(Sim, PhysicsCalculator):
             orig.store.pos_data[i] = [particle.initial_pos]
 
 
-        self = SimulationVisualiser(orig.store, E=self.E, M=self.M, G=self.G, with_minmax=self.with_minmax)
+        self = SimulationVisualiser(orig.store, E=self.E, M=self.M, G=self.G, with_minmax=self.with_minmax,
+                                    vectorised=self.vectorised, solver=self.solver, theta=self.theta,
+                                    cutoff=self.cutoff, skin=self.skin, broad_phase=self.broad_phase,
+                                    ccd=self.ccd, substeps=self.substeps)
         self.load_graphs(orig_graph_vars)
-        self.pre_compute()
-        self.calc_and_display_minmax()
+        self.start_stream()
+        if self.with_minmax:
+            self.finish_stream()  # The statistics need the whole run
+            self.calc_and_display_minmax()
         self.Run()
 
     def Run(self):
-        frames_left = int(self.run_time / self.dt)
-        time = 0
         self._loadParticles()
 
         # Initialize all particle positions in a single step
-        for particle, pos_data in zip(self.particles.array_particles, self.store.pos_data):
-            particle.pos = pos_data[0]
+        for particle, pos in zip(self.particles.array_particles, self._frame_vectors("pos", 0)):
+            particle.show_at(pos)
 
         self.iter_count = 0
+        plotted = -1  # Last frame added to the graphs
 
         # Precompute constants and avoid repetitive dictionary lookups
         masses = [self.store.initial_conditions[i]["Mass"] for i in range(self.particles.array_size)]
@@ -489,33 +732,27 @@ class SimulationVisualiser(Sim, PhysicsCalculator):
             #    rate(self.rate)  # Ensures smooth rendering while paused
             #    continue
             if self.running:
-                time += self.dt
-                rate(self.rate*1000)
+                time = (self.iter_count + 1) * self.store.output_interval
+                rate(self.rate*1000*self.substeps)
 
                 # Update the slider's value
                 self.time_slider.value = self.iter_count
 
-                # Extract frame-specific data for all particles in one step
-                frame_pos_data = [pos[self.iter_count] for pos in self.store.pos_data]
-                frame_vel_data = [vel[self.iter_count] for vel in self.store.vel_data]
-                frame_acc_data = [acc[self.iter_count] for acc in self.store.acc_data]
-
-                # Update all particles
-                for idx, (particle, pos, vel, acc, mass) in enumerate(
-                    zip(self.particles.array_particles, frame_pos_data, frame_vel_data, frame_acc_data, masses)
-                ):
-                    particle.pos = pos
-                    particle.velocity = vel
-                    particle.acceleration = acc
-
-                    particle.update_obj_position()
-
-                    # Update lines for each variable using the external index
-                    for variable, line_array in self.Lines.items():
-                        dependent_d = self.var_to_func[variable](vel_v=vel, mass=mass, acc_v=acc)
-                        line_array[idx].plot(time, dependent_d)
-                    
-                if self.iter_count < (frames_left - 1):
-                    self.iter_count += 1
+                # Positions between recorded frames when playing substeps
+                for particle, pos in zip(self.particles.array_particles,
+                                         self._interpolated_positions(self.iter_count, self._sub / self.substeps)):
+                    particle.show_at(pos)
+
+                # Update lines for each variable using the external index, once per frame
+                if self.iter_count != plotted:
+                    frame_vel_data = self._frame_vectors("vel", self.iter_count)
+                    frame_acc_data = self._frame_vectors("acc", self.iter_count)
+                    for idx, (vel, acc, mass) in enumerate(zip(frame_vel_data, frame_acc_data, masses)):
+                        for variable, line_array in self.Lines.items():
+                            dependent_d = self.var_to_func[variable](vel_v=vel, mass=mass, acc_v=acc)
+                            line_array[idx].plot(time, dependent_d)
+                    plotted = self.iter_count
+
+                self._advance_playback()
             else:
                 rate(10)
\ No newline at end of file
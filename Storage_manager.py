@@ -0,0 +1,292 @@
+import base64
+import os
+import shutil
+import tempfile
+import weakref
+import zlib
+import numpy as np
+from vpython import vector
+
+class Trajectory:
+    """One recorded quantity (position, velocity or acceleration) for every particle,
+    held in a single (frames, N, 3) NumPy array instead of lists of vpython vectors.
+
+    Each particle keeps its own length, since the channels are not always filled
+    in step (e.g. the last acceleration is recorded after the loop). The array is
+    allocated once at the expected number of frames and only doubles if a run
+    records more than that.
+    """
+    def __init__(self, n, dtype=np.float64, expected_frames=0):
+        self.dtype = np.dtype(dtype)
+        self.expected_frames = expected_frames
+        self.data = np.zeros((0, n, 3), dtype=self.dtype)
+        self.lengths = np.zeros(n, dtype=int)
+
+    def __deepcopy__(self, memo):
+        # Copy only the frames in use, so copying a store before a run doesn't touch the preallocated space
+        copy = self.empty_like()
+        copy.load(self)
+        return copy
+
+    def empty_like(self):
+        return Trajectory(len(self.lengths), self.dtype, self.expected_frames)
+
+    @property
+    def frames(self):
+        """Length of the longest particle trajectory"""
+        return int(self.lengths.max(initial=0))
+
+    def reserve(self, frames):
+        if frames > len(self.data):
+            grown = np.zeros((frames,) + self.data.shape[1:], dtype=self.dtype)
+            grown[:len(self.data)] = self.data
+            self.data = grown
+
+    def _make_room(self, frames):
+        if frames > len(self.data):
+            self.reserve(max(frames, self.expected_frames, 2 * len(self.data)))
+
+    def append(self, i, value):
+        self._make_room(self.lengths[i] + 1)
+        self.data[self.lengths[i], i] = as_xyz(value)
+        self.lengths[i] += 1
+
+    def append_frame(self, values):
+        """Append one (N, 3) row, a value for every particle"""
+        self._make_room(self.frames + 1)
+        self.data[self.lengths, np.arange(len(self.lengths))] = values
+        self.lengths += 1
+
+    def set_particle(self, i, values):
+        if isinstance(values, np.ndarray):
+            self._make_room(len(values))
+            self.lengths[i] = len(values)
+            self.data[:len(values), i] = values
+            return
+        values = [as_xyz(value) for value in values]
+        self._make_room(len(values))
+        self.lengths[i] = len(values)
+        if values:
+            self.data[:len(values), i] = values
+
+    def truncate(self, frames):
+        """Forget everything after the first frames frames"""
+        np.minimum(self.lengths, frames, out=self.lengths)
+
+    def particle(self, i):
+        """(frames, 3) view of one particle's trajectory"""
+        return self.data[:self.lengths[i], i]
+
+    def frame(self, f):
+        """(N, 3) view of every particle at frame f"""
+        return self.data[f]
+
+    def block(self, start, stop):
+        """(stop - start, N, 3) view of a run of frames"""
+        return self.data[start:stop]
+
+    def load(self, source):
+        """Replace the contents with another Trajectory, a view of one, or per-particle lists of vectors"""
+        if isinstance(source, Trajectory_View):
+            source = source.trajectory
+        if isinstance(source, Trajectory):
+            frames = source.frames
+            self.reserve(frames)
+            self.data[:frames] = source.data[:frames]
+            self.lengths = source.lengths.copy()
+            return
+        self.lengths = np.zeros(len(source), dtype=int)
+        for i, values in enumerate(source):
+            self.set_particle(i, values)
+
+
+class Mapped_Trajectory(Trajectory):
+    """Trajectory whose array is a np.memmap over a file, for runs too long to hold in memory.
+
+    Frames are written straight to the file and the operating system only keeps
+    the pages that are being read or written in memory. The file is deleted when
+    the trajectory is garbage collected.
+    """
+    def __init__(self, n, directory, dtype=np.float64, expected_frames=0):
+        super().__init__(n, dtype, expected_frames)
+        self.directory = directory
+        handle, self.path = tempfile.mkstemp(suffix=".traj", dir=directory)
+        os.close(handle)
+        self._finalizer = weakref.finalize(self, _remove_file, self.path)
+
+    def empty_like(self):
+        return Mapped_Trajectory(len(self.lengths), self.directory, self.dtype, self.expected_frames)
+
+    def reserve(self, frames):
+        if frames > len(self.data):
+            shape = (frames,) + self.data.shape[1:]
+            if not np.prod(shape):
+                return  # np.memmap can't map an empty file
+            if isinstance(self.data, np.memmap):
+                self.data.flush()
+            # Frames are the outer axis, so growing the file keeps every recorded frame in place
+            with open(self.path, "r+b") as file:
+                file.truncate(int(np.prod(shape)) * self.dtype.itemsize)
+            self.data = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=shape)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class Storage_Directory:
+    """Temporary directory for memory-mapped trajectories, deleted with its contents
+    once neither its store nor any trajectory mapped inside it is left.
+
+    Deep copies share the directory rather than making another one.
+    """
+    def __init__(self, prefix="simulation_"):
+        self.path = tempfile.mkdtemp(prefix=prefix)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+    def cleanup(self):
+        self._finalizer()
+
+
+# Reduced-precision encodings for saved trajectories, see encode_trajectory
+ENCODINGS = ("float64", "float32", "delta", "quantized")
+
+
+def encode_trajectory(trajectory, encoding, error_bound=None):
+    """One JSON-friendly payload per particle, for files and database rows.
+
+        float32    the values rounded to float32
+        delta      each particle's first frame, then float32 steps between frames.
+                   Every step is taken from the reconstruction so far rather than
+                   the previous exact value, so rounding errors don't build up
+        quantized  integers on a grid of spacing 2 * error_bound from the first
+                   frame, stored as differences between frames; every value is
+                   within error_bound of the original
+    The packed bytes are zlib-compressed and base64 text. decode_payload reverses it.
+    """
+    if encoding not in ENCODINGS or encoding == "float64":
+        raise ValueError(f"Unknown trajectory encoding: {encoding}")
+    data = np.asarray(trajectory.block(0, trajectory.frames), dtype=np.float64)
+    origin = data[0] if len(data) else np.zeros(data.shape[1:])
+    step = None
+
+    if encoding == "float32":
+        packed = data.astype(np.float32)
+    elif encoding == "delta":
+        packed = np.empty(data.shape, dtype=np.float32)
+        packed[:1] = 0
+        rebuilt = origin.copy()
+        for f in range(1, len(data)):
+            packed[f] = data[f] - rebuilt
+            rebuilt += packed[f]
+    else:
+        if not error_bound or error_bound <= 0:
+            raise ValueError("Quantized encoding needs a positive error bound")
+        step = 2.0 * error_bound
+        grid = np.rint((data - origin) / step).astype(np.int64)
+        packed = np.diff(grid, axis=0, prepend=np.zeros_like(grid[:1]))
+
+    payloads = []
+    for i, length in enumerate(trajectory.lengths.tolist()):
+        payloads.append({
+            "Encoding": encoding,
+            "Frames": length,
+            "Type": packed.dtype.str,
+            "Origin": origin[i].tolist(),
+            "Step": step,
+            "Data": base64.b64encode(zlib.compress(np.ascontiguousarray(packed[:length, i]).tobytes())).decode("ascii"),
+        })
+    return payloads
+
+
+def decode_payload(payload):
+    """(frames, 3) float64 array from one encode_trajectory payload"""
+    raw = zlib.decompress(base64.b64decode(payload["Data"]))
+    packed = np.frombuffer(raw, dtype=np.dtype(payload["Type"])).reshape(payload["Frames"], 3)
+    origin = np.array(payload["Origin"], dtype=np.float64)
+    if payload["Encoding"] == "float32":
+        return packed.astype(np.float64)
+    if payload["Encoding"] == "delta":
+        values = packed.astype(np.float64)
+        values[:1] = origin
+        return np.cumsum(values, axis=0)
+    if payload["Encoding"] == "quantized":
+        return origin + np.cumsum(packed, axis=0) * payload["Step"]
+    raise ValueError(f"Unknown trajectory encoding: {payload['Encoding']}")
+
+
+def as_xyz(value):
+    # vpython vectors and plain sequences both become (x, y, z)
+    if hasattr(value, "x"):
+        return (value.x, value.y, value.z)
+    return tuple(value)
+
+
+class Trajectory_View:
+    """List-of-lists style access to a Trajectory, so store.pos_data[i][frame] keeps returning a vector"""
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+
+    def __len__(self):
+        return len(self.trajectory.lengths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("particle index out of range")
+        return Particle_Trajectory(self.trajectory, i)
+
+    def __setitem__(self, i, values):
+        self.trajectory.set_particle(i, values)
+
+    def __iter__(self):
+        return (Particle_Trajectory(self.trajectory, i) for i in range(len(self)))
+
+    def tolist(self):
+        return [self.trajectory.particle(i).tolist() for i in range(len(self))]
+
+
+class Particle_Trajectory:
+    """One particle's trajectory, indexed by frame like the list of vectors it replaces"""
+    def __init__(self, trajectory, index):
+        self.trajectory = trajectory
+        self.index = index
+
+    def __len__(self):
+        return int(self.trajectory.lengths[self.index])
+
+    def __getitem__(self, frame):
+        if isinstance(frame, slice):
+            return [vector(*xyz) for xyz in self.trajectory.particle(self.index)[frame].tolist()]
+        if frame < 0:
+            frame += len(self)
+        if not 0 <= frame < len(self):
+            raise IndexError("frame index out of range")
+        return vector(*self.trajectory.frame(frame)[self.index].tolist())
+
+    def __iter__(self):
+        return (vector(*xyz) for xyz in self.trajectory.particle(self.index).tolist())
+
+    def append(self, value):
+        self.trajectory.append(self.index, value)
+
+    def tolist(self):
+        return self.trajectory.particle(self.index).tolist()
+
+    def __repr__(self):
+        return repr(list(self))
@@ -4,6 +4,7 @@ from tkinter import messagebox
 from tkinter.ttk import Combobox
 from tksheet import Sheet
 from Dependency_graph import DependencyGraph
+from Integrator_manager import INTEGRATORS
 from Simulation_manager import *
 from Database_manager import *
 from os import listdir
@@ -29,7 +30,9 @@ class UI_Manager_class:
         self.store = None               # Current simulation data storage
         self.current_user = None        # Authenticated user
         self.db_manager = Database_manager()  # Database interaction handler
-        self.sim_increment = 0.00001    # Fixed physics time step
+        self.sim_increment = 0.00001    # Default physics time step
+        self.sim_integrator = "euler"   # Default time integration scheme
+        self.sim_output_stride = 1      # Integration steps per recorded frame
         self.dependency_graph = DependencyGraph()  # Simulation version tracking
 
         # Input validation setup
@@ -87,9 +90,10 @@ class UI_Manager_class:
                                 M=self.sim_magnetic_on,
                                 G=self.sim_gravity_on)
                 
-        # Precompute simulation data and run
-        self.simulation.pre_compute()
+        # Compute in the background and start playback as soon as the first frames are recorded
+        self.simulation.start_stream()
         if self.with_minmax:
+            self.simulation.finish_stream()  # The statistics need the whole run
             self.simulation.calc_and_display_minmax()
         self.simulation.Run()
 
@@ -279,6 +283,24 @@ class UI_Manager_class:
         duration_slider.set(2.5)
         duration_slider.pack(side=LEFT)
 
+        # Time integration controls - the higher-order schemes stay stable at larger time steps
+        Label(self.root, text="Integrator:").pack()
+        integrator_var = StringVar(value=self.sim_integrator)
+        Combobox(self.root, textvariable=integrator_var, values=list(INTEGRATORS),
+                 state="readonly").pack()
+
+        Label(self.root, text="Time step (sec):").pack()
+        increment_entry = Entry(self.root, width=10, validate="all",
+                                validatecommand=(self.validate_float, '%P'))
+        increment_entry.insert(0, "0.00001")
+        increment_entry.pack()
+
+        # Recording fewer frames than steps keeps long runs small without changing the integration
+        Label(self.root, text="Record every N steps:").pack()
+        stride_entry = Entry(self.root, width=10, validate="all", validatecommand=(self.validate_int, '%P'))
+        stride_entry.insert(0, str(self.sim_output_stride))
+        stride_entry.pack()
+
         # Field activation checkboxes
         fields_frame = Frame(self.root)
         fields_frame.pack()
@@ -297,10 +319,20 @@ class UI_Manager_class:
             self.sim_name = name_entry.get()
             self.sim_rate = float(rate_entry.get())
             self.sim_duration = float(duration_entry.get())
+            self.sim_integrator = integrator_var.get()
+            self.sim_increment = float(increment_entry.get())
+            self.sim_output_stride = int(stride_entry.get() or 1)
             self.sim_electric_on = electric_var.get()
             self.sim_magnetic_on = magnetic_var.get()
             self.sim_gravity_on = gravity_var.get()
 
+            if self.sim_increment <= 0.0:
+                messagebox.showerror("Error", "Time step must be positive")
+                return
+            if self.sim_output_stride < 1:
+                messagebox.showerror("Error", "Steps per recorded frame must be at least 1")
+                return
+
             # Check for existing simulation name
             if self.db_manager.name_exists(self.sim_name):
                 messagebox.showerror("Error", "Simulation name already exists")
@@ -343,10 +375,10 @@ class UI_Manager_class:
         sheet_frame.pack()
         sheet = Sheet(sheet_frame,
                      headers=["Charge", "Mass", "Position (X,Y,Z)", 
-                             "Velocity (X,Y,Z)", "Radius", "Colour"],
-                     width=600,
+                             "Velocity (X,Y,Z)", "Radius", "Colour", "Test"],
+                     width=670,
                      height=250)
-        sheet.set_column_widths([70, 70, 120, 120, 70, 70])
+        sheet.set_column_widths([70, 70, 120, 120, 70, 70, 70])
         sheet.pack()
         sheet.enable_bindings()
 
@@ -357,16 +389,17 @@ class UI_Manager_class:
             position = (particle.pos.x, particle.pos.y, particle.pos.z)
             velocity = (particle.velocity.x, particle.velocity.y, particle.velocity.z)
             sheet.insert_row([particle.charge, particle.mass, position, 
-                            velocity, particle.radius, colour])
+                            velocity, particle.radius, colour,
+                            "Yes" if particle.is_test_particle else "No"])
         
         # Initialize empty row if needed
         if len(sheet.get_sheet_data()) == 0:
-            sheet.insert_row(["", "", "", "", "", ""])
+            sheet.insert_row(["", "", "", "", "", "", "No"])
         
         # Spreadsheet manipulation functions
         def add_row(charge="1", mass="1", pos=(0, 0, 0), 
-                   vel=(0, 0, 0), radius="0.25", colour="red"):
-            sheet.insert_row([charge, mass, pos, vel, radius, colour])
+                   vel=(0, 0, 0), radius="0.25", colour="red", test="No"):
+            sheet.insert_row([charge, mass, pos, vel, radius, colour, test])
         
         def remove_selected_row():
             selected_rows = list(sheet.get_selected_rows())
@@ -378,7 +411,7 @@ class UI_Manager_class:
             
         def add_particle_from_text():
             # Command-line style particle input
-            if (sheet.get_sheet_data() == ["", "", "", "", "", ""]):
+            if (sheet.get_sheet_data() == ["", "", "", "", "", "", "No"]):
                 sheet.delete_row(0)
 
             try:
@@ -386,12 +419,14 @@ class UI_Manager_class:
                 if data:
                     values = data.split()
                     if len(values) == 6:
-                        sheet.insert_row(values)
+                        sheet.insert_row(values + ["No"])
+                    elif len(values) == 7 and values[6].lower() == "test":
+                        sheet.insert_row(values[:6] + ["Yes"])
                 else:
                     raise Exception("Empty input")
             except:
                 message = """Input format:
-                CHARGE MASS INITIAL_POSITION INITIAL_VELOCITY RADIUS COLOUR
+                CHARGE MASS INITIAL_POSITION INITIAL_VELOCITY RADIUS COLOUR [test]
                 Example: 0.25 100 (0,0,0) (0,0,0) 0.25 red"""
                 messagebox.showerror("Error", message)
                 
@@ -409,6 +444,7 @@ class UI_Manager_class:
                     vel_vector = self.parse_vector(row[3])
                     radius = float(row[4])
                     colour = self.colour_mapping[row[5].lower()]
+                    is_test = len(row) > 6 and str(row[6]).strip().lower() in ("yes", "y", "true")
 
                     if mass <= 0.0 or radius <= 0.0:
                         messagebox.showerror("Error", "Invalid mass/radius")
@@ -421,12 +457,14 @@ class UI_Manager_class:
                     existing_positions.append(pos_vector)
                     particles.append(Particle(charge, mass, pos_vector, 
                                             vel_vector, vector(0,0,0), 
-                                            radius, colour))
+                                            radius, colour, is_test))
                 
                 # Create simulation state
                 self.store = SimulationState(particles)
                 self.store.build(self.sim_name, self.sim_rate, 
-                                self.sim_increment, self.sim_duration)
+                                self.sim_increment, self.sim_duration,
+                                self.sim_integrator)
+                self.store.set_output_stride(self.sim_output_stride)
                 self.graphs_page()
                 
             except Exception as e:
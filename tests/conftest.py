@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _Widget:
+    """Stands in for the vpython canvas, buttons, sliders and text, so a Sim can be built without a browser"""
+    def __init__(self, *args, **kwargs):
+        self.value = kwargs.get("value", 0)
+        self.max = kwargs.get("max", 0)
+        self.text = kwargs.get("text", "")
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+
+@pytest.fixture
+def headless(monkeypatch):
+    """The Simulation_manager module with its vpython widgets replaced by _Widget"""
+    import Simulation_manager
+    for name in ("canvas", "button", "slider", "wtext", "checkbox"):
+        monkeypatch.setattr(Simulation_manager, name, _Widget)
+    monkeypatch.setattr(Simulation_manager, "rate", lambda frequency: None)
+    return Simulation_manager
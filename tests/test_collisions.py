@@ -0,0 +1,254 @@
+import sqlite3
+from copy import deepcopy
+
+import numpy as np
+import pytest
+from vpython import vector
+
+from Analysis_manager import Analysis_manager
+from Collision_manager import Collision_manager
+from Database_manager import Database_manager
+from Neighbour_manager import Sweep_And_Prune, Spatial_Hash
+from Particle_manager import Particle, Particle_Group, SimulationState
+
+
+def cloud(n=60, seed=0, radius=0.05, size=1.0):
+    rng = np.random.default_rng(seed)
+    return [Particle(0.0, rng.uniform(0.5, 2.0), vector(*rng.uniform(0, size, 3)), vector(*rng.normal(0, 1, 3)),
+                     vector(0, 0, 0), radius, vector(1, 0, 0)) for _ in range(n)]
+
+
+def drift(particles, dt):
+    for particle in particles:
+        particle.pos = particle.pos + particle.velocity * dt
+
+
+def brute_force_pairs(pos, radius, boxes=False):
+    i, j = np.triu_indices(len(pos), 1)
+    if boxes:
+        reach = (radius[i] + radius[j])[:, np.newaxis]
+        close = (np.abs(pos[j] - pos[i]) < reach).all(axis=1)
+    else:
+        d = pos[j] - pos[i]
+        close = np.einsum("ij,ij->i", d, d) < (radius[i] + radius[j]) ** 2
+    return set(zip(i[close].tolist(), j[close].tolist()))
+
+
+def test_sweep_and_prune_events_track_the_overlapping_boxes():
+    rng = np.random.default_rng(1)
+    pos = rng.uniform(0, 1, (80, 3))
+    vel = rng.normal(0, 1, (80, 3))
+    radius = rng.uniform(0.02, 0.08, 80)
+    sweep = Sweep_And_Prune()
+    pairs = set()
+    for _ in range(40):
+        added, removed = sweep.update(pos, radius)
+        pairs = (pairs | set(added)) - set(removed)
+        assert pairs == sweep.pairs == brute_force_pairs(pos, radius, boxes=True)
+        pos = pos + vel * 0.01
+
+
+def test_spatial_hash_finds_every_touching_pair():
+    rng = np.random.default_rng(2)
+    pos = rng.uniform(0, 1, (200, 3))
+    radius = rng.uniform(0.01, 0.05, 200)
+    candidates = set(map(tuple, Spatial_Hash().update(pos, radius).tolist()))
+    assert brute_force_pairs(pos, radius) <= candidates
+
+
+@pytest.mark.parametrize("broad_phase", ["hash", "sweep"])
+def test_broad_phases_give_the_brute_force_contacts(broad_phase):
+    particles = cloud()
+    manager = Collision_manager(Particle_Group(particles), 1, broad_phase)
+    reference = deepcopy(particles)
+    for _ in range(30):
+        pos = np.array([[p.pos.x, p.pos.y, p.pos.z] for p in particles])
+        touching = brute_force_pairs(pos, np.full(len(particles), 0.05))
+        manager.collisionDetection()
+        assert manager.contacts == {i * len(particles) + j for i, j in touching}
+        drift(particles, 0.01)
+    # Both broad phases resolve the same contacts in the same order
+    other = Collision_manager(Particle_Group(reference), 1, "sweep" if broad_phase == "hash" else "hash")
+    for _ in range(30):
+        other.collisionDetection()
+        drift(reference, 0.01)
+    assert other.bounces == manager.bounces
+    for a, b in zip(particles, reference):
+        assert (a.velocity.x, a.velocity.y, a.velocity.z) == (b.velocity.x, b.velocity.y, b.velocity.z)
+
+
+@pytest.mark.parametrize("e", [1, 0.6])
+def test_batched_response_matches_sequential_collide(e):
+    particles = cloud(n=40, seed=3, radius=0.12)
+    batched = Collision_manager(Particle_Group(particles), e)
+    reference = deepcopy(particles)
+    sequential = Collision_manager(Particle_Group(reference), e)
+
+    pos = np.array([[p.pos.x, p.pos.y, p.pos.z] for p in particles])
+    contacts = sorted(brute_force_pairs(pos, np.full(len(particles), 0.12)))
+    assert len({i for pair in contacts for i in pair}) < 2 * len(contacts)  # Some particles touch several others
+    batched.resolve_contacts([i * len(particles) + j for i, j in contacts])
+    for i, j in contacts:
+        sequential.collide(reference[i], reference[j])
+
+    for a, b in zip(particles, reference):
+        np.testing.assert_allclose([a.velocity.x, a.velocity.y, a.velocity.z],
+                                   [b.velocity.x, b.velocity.y, b.velocity.z], rtol=1e-9, atol=1e-12)
+    assert len(batched.collision_log) == len(contacts)
+
+
+def head_on_store():
+    particles = [Particle(0.0, 1.0, vector(0.5 * i, 0.02 * i, 0), vector(1.0 * (-1) ** i, 0, 0), vector(0, 0, 0), 0.1,
+                          vector(1, 0, 0)) for i in range(6)]
+    store = SimulationState(particles)
+    store.build("collisions", 10, 1e-2, 1.0, "euler")
+    return store
+
+
+def test_collision_log_holds_steps_whatever_the_output_stride(headless):
+    every_step = head_on_store()
+    headless.Sim(every_step, E=False).pre_compute()
+    strided = head_on_store()
+    headless.Sim(strided, E=False, output_stride=4).pre_compute()
+
+    steps = every_step.collision_log.column("step")
+    assert len(steps) > 0
+    np.testing.assert_array_equal(strided.collision_log.column("step"), steps)
+    events = Analysis_manager(strided).collision_events()
+    np.testing.assert_array_equal(events["frame"], steps // 4)
+    np.testing.assert_allclose(events["time"], steps * 1e-2)
+    late = Analysis_manager(strided).collision_events(first_frame=int(steps[-1]) // 4)
+    assert len(late["step"]) == np.count_nonzero(steps // 4 >= steps[-1] // 4)
+
+
+def test_old_collision_tables_are_migrated_to_steps(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    connection = sqlite3.connect("ParticleDatabase.db")
+    connection.execute("""CREATE TABLE Collisions (EventID INTEGER PRIMARY KEY AUTOINCREMENT, Sim_Name TEXT,
+        Frame INTEGER, First INTEGER, Second INTEGER, NormalX FLOAT, NormalY FLOAT, NormalZ FLOAT,
+        RelativeSpeed FLOAT, Impulse FLOAT)""")
+    connection.execute("INSERT INTO Collisions (Sim_Name, Frame, First, Second) VALUES ('old', 7, 0, 1)")
+    connection.commit()
+    connection.close()
+
+    Database_manager().initialize_database()
+    connection = sqlite3.connect("ParticleDatabase.db")
+    assert connection.execute("SELECT Step FROM Collisions WHERE Sim_Name = 'old'").fetchone() == (7,)
+    connection.close()
+
+
+@pytest.mark.parametrize("cutoff", [None, 0.3])
+def test_collision_pairs_cover_every_touching_source_pair(cutoff):
+    # Mixed radii, so cells sized for the typical particle still have to catch the large ones
+    particles = cloud(n=150, seed=6, radius=0.03)
+    for particle in particles[::15]:
+        particle.radius = 0.12
+    for particle in particles[1::10]:
+        particle.is_test_particle = True
+    group = Particle_Group(particles)
+    if cutoff is not None:
+        group.set_cutoff(cutoff)
+    pos, radius = group.positions(), group.radii()
+    is_test = np.array([p.is_test_particle for p in particles])
+    touching = {(i, j) for i, j in brute_force_pairs(pos, radius) if not is_test[i] and not is_test[j]}
+
+    candidates = set(map(tuple, group.collision_pairs().tolist()))
+    assert touching and touching <= candidates
+    assert not any(is_test[i] or is_test[j] for i, j in candidates)
+    assert all(i < j for i, j in candidates)
+
+
+def test_collision_pairs_catch_pairs_that_closed_in_since_the_list_was_built():
+    particles = cloud(n=2, seed=9, radius=0.09)
+    particles[0].pos, particles[1].pos = vector(0, 0, 0), vector(0.27, 0, 0)
+    group = Particle_Group(particles)
+    group.set_cutoff(0.1, 0.1)
+    assert len(group.neighbour_list.pairs) == 0
+    # Each moves just under half the skin, so the list is kept, but together they close in to touching
+    particles[0].pos, particles[1].pos = vector(0.049, 0, 0), vector(0.221, 0, 0)
+    assert not group.neighbour_list.needs_rebuild(group.positions())
+    assert group.collision_pairs().tolist() == [[0, 1]]
+
+
+def fast_pair_store():
+    particles = [Particle(0.0, 1.0, vector(-1.125, 0, 0), vector(50, 0, 0), vector(0, 0, 0), 0.05, vector(1, 0, 0)),
+                 Particle(0.0, 1.0, vector(1, 0.01, 0), vector(-50, 0, 0), vector(0, 0, 0), 0.05, vector(0, 0, 1))]
+    store = SimulationState(particles)
+    store.build("fast", 10, 1e-2, 0.1, "euler")
+    return store
+
+
+@pytest.mark.parametrize("ccd", [False, True])
+def test_continuous_collisions_stop_fast_particles_tunnelling(headless, ccd):
+    # Each step moves a particle 0.5, five times its radius, so the overlap test never sees them touch
+    store = fast_pair_store()
+    headless.Sim(store, E=False, M=False, G=False, ccd=ccd).pre_compute()
+    x = store.channel("pos").block(0, store.recorded_frames)[:, :, 0]
+    if ccd:
+        assert (x[:, 0] < x[:, 1]).all()
+        assert len(store.collision_log) == 1
+    else:
+        assert x[-1, 0] > x[-1, 1]
+        assert len(store.collision_log) == 0
+
+
+def test_pairs_bounce_once_per_contact():
+    particles = cloud(n=5, seed=7, radius=0.05)
+    manager = Collision_manager(Particle_Group(particles), 1)
+    n = len(particles)
+
+    def place(*xs):
+        for particle, x in zip(particles, xs):
+            particle.pos = vector(x, 0, 0)
+        manager.collisionDetection()
+
+    place(0, 0.09, 1, 2, 3)
+    assert manager.contacts == {0 * n + 1} and manager.bounces == 1
+    place(0, 0.08, 1, 3, 3.05)  # Still touching, and 3-4 meet
+    assert manager.contacts == {0 * n + 1, 3 * n + 4} and manager.bounces == 2
+    place(0, 0.5, 1, 3, 3.05)
+    assert manager.contacts == {3 * n + 4} and manager.bounces == 2
+    place(0, 0.09, 1, 3, 3.05)
+    assert manager.bounces == 3
+
+
+@pytest.mark.parametrize("e", [1, 0.6])
+def test_contacts_exchange_momentum_along_the_normal_only(e):
+    particles = cloud(n=2, seed=8, radius=0.1)
+    particles[0].pos, particles[1].pos = vector(0, 0, 0), vector(0.15, 0.05, 0)
+    particles[0].velocity, particles[1].velocity = vector(2, 1, -1), vector(0, 0, 0.5)
+    manager = Collision_manager(Particle_Group(particles), e)
+    mass = np.array([p.mass for p in particles])
+    normal = np.array([0.15, 0.05, 0]) / np.linalg.norm([0.15, 0.05, 0])
+
+    def velocities():
+        return np.array([[p.velocity.x, p.velocity.y, p.velocity.z] for p in particles])
+
+    before = velocities()
+    manager.resolve_contacts([1])
+    after = velocities()
+    np.testing.assert_allclose(mass @ after, mass @ before, rtol=1e-12)
+    # Tangential parts are untouched and the normal closing speed is reversed and scaled by e
+    tangential = lambda v: v - np.outer(v @ normal, normal)
+    np.testing.assert_allclose(tangential(after), tangential(before), atol=1e-12)
+    closing = lambda v: (v[0] - v[1]) @ normal
+    assert closing(after) == pytest.approx(-e * closing(before))
+    energy = lambda v: 0.5 * mass @ np.einsum("ij,ij->i", v, v)
+    assert energy(after) == pytest.approx(energy(before)) if e == 1 else energy(after) < energy(before)
+
+
+def test_vectorised_collisions_work_on_the_arrays(headless, monkeypatch):
+    pairwise = head_on_store()
+    headless.Sim(pairwise, E=False).pre_compute()
+
+    def sync(group):
+        raise AssertionError("collisions shouldn't sync every particle")
+    monkeypatch.setattr(headless.Vectorised_Particle_Group, "sync_to_particles", sync)
+    vectorised = head_on_store()
+    initial = [(p.pos, p.velocity) for p in vectorised.particles]
+    headless.Sim(vectorised, E=False, vectorised=True).pre_compute()
+
+    assert len(vectorised.collision_log) == len(pairwise.collision_log) > 0
+    np.testing.assert_allclose(vectorised.channel("pos").block(0, vectorised.recorded_frames),
+                               pairwise.channel("pos").block(0, pairwise.recorded_frames), rtol=1e-12, atol=1e-12)
+    assert [(p.pos, p.velocity) for p in vectorised.particles] == initial
@@ -0,0 +1,48 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from Database_manager import Database_manager
+from test_simulation import make_store, channels
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = Database_manager()
+    assert manager.create_user("tester", "password")
+    return manager
+
+
+@pytest.mark.parametrize("encoding, error_bound", [("float64", None), ("float32", None), ("delta", None),
+                                                   ("quantized", 1e-9)])
+def test_saved_runs_load_back_from_the_database(headless, database, encoding, error_bound):
+    store = make_store(integrator="verlet")
+    headless.Sim(store, output_stride=2).pre_compute()
+    store.set_encoding(encoding, error_bound)
+    database.attach_store(store)
+    database.dump_to_db("tester")
+
+    loader = Database_manager()
+    loader.pull_from_db("run")
+    loaded = loader.eject_store()
+    assert (loaded.integrator, loaded.output_stride) == ("verlet", 2)
+
+    tolerance = {"float64": 0, "float32": 2 ** -24, "delta": 2 ** -23, "quantized": 0}[encoding]
+    for expected, actual in zip(channels(store), channels(loaded)):
+        assert actual.shape == expected.shape
+        if encoding == "quantized":
+            assert np.abs(actual - expected).max() <= error_bound * (1 + 1e-6)
+        else:
+            np.testing.assert_allclose(actual, expected, rtol=tolerance, atol=tolerance * np.abs(expected).max())
+
+    # Plain float encodings are saved as packed bytes, the others as compressed text payloads
+    connection = sqlite3.connect("ParticleDatabase.db")
+    blob, text = connection.execute("SELECT Pos_Blob, Pos_Data FROM Particles_Data").fetchone()
+    connection.close()
+    if encoding in ("float64", "float32"):
+        assert isinstance(blob, bytes) and text is None
+        assert len(blob) == store.recorded_frames * 3 * (8 if encoding == "float64" else 4)
+    else:
+        assert blob is None and text.startswith("{")
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from Ensemble_manager import Ensemble, sweep
+from test_simulation import make_store, channels, Q
+
+
+@pytest.mark.parametrize("integrator", ["euler", "verlet", "rk4", "boris"])
+def test_ensemble_variants_match_separate_runs(headless, integrator):
+    variants = [{}] + sweep(0, "Mass", [3.0]) + [{1: {"Charge": Q}, 2: {"Mass": 0.5}}]
+    ensemble = Ensemble(make_store(integrator=integrator), variants).pre_compute()
+
+    for overrides, batched in zip(variants, ensemble):
+        store = make_store(integrator=integrator)
+        for index, changes in overrides.items():
+            for key, value in changes.items():
+                setattr(store.particles[index], key.lower(), value)
+        headless.Sim(store, vectorised=True).pre_compute()
+        for expected, actual in zip(channels(store), channels(batched)):
+            np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12 * np.abs(expected).max())
+    assert not np.allclose(channels(ensemble[0])[0], channels(ensemble[1])[0])
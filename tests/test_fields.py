@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from vpython import vector
+
+from Particle_manager import Particle, Particle_Group, Vectorised_Particle_Group, COULOMB_K
+from Octree_manager import Barnes_Hut_Solver
+from Mesh_manager import Particle_Mesh_Solver
+from Parallel_manager import Parallel_Pair_Solver
+
+UPDATES = {"E": "E_Acceleration_Update", "M": "M_Acceleration_Update", "G": "G_Acceleration_Update"}
+
+
+def cloud(n=40, seed=0, tests=0):
+    rng = np.random.default_rng(seed)
+    return [Particle(rng.normal(0, 1e-5), rng.uniform(0.5, 2.0), vector(*rng.uniform(-1, 1, 3)),
+                     vector(*rng.normal(0, 1e3, 3)), vector(0, 0, 0), 0.01, vector(1, 0, 0), i >= n - tests)
+            for i in range(n)]
+
+
+def pairwise_acceleration(particles, fields):
+    """Reference: the per-field pair loops over vpython vectors"""
+    group = Particle_Group(particles)
+    group.resetAccelerations()
+    for field in fields:
+        getattr(group, UPDATES[field])()
+    return group.state_arrays()[2]
+
+
+def vectorised_acceleration(particles, fields):
+    group = Vectorised_Particle_Group(particles)
+    group.resetAccelerations()
+    for field in fields:
+        getattr(group, UPDATES[field])()
+    return group.acc.copy()
+
+
+def solver_acceleration(particles, fields, solver):
+    group = Vectorised_Particle_Group(particles, solver)
+    group._precompute_pair_data()
+    group.resetAccelerations()
+    group.interaction_kernel("E" in fields, "M" in fields, "G" in fields)()
+    return group.acc.copy()
+
+
+def relative_error(acc, expected):
+    return np.linalg.norm(acc - expected) / np.linalg.norm(expected)
+
+
+@pytest.mark.parametrize("fields", ["E", "M", "G", "EMG"])
+def test_vectorised_updates_match_the_pair_loops(fields):
+    particles = cloud()
+    expected = pairwise_acceleration(particles, fields)
+    np.testing.assert_allclose(vectorised_acceleration(particles, fields), expected,
+                               rtol=1e-9, atol=1e-12 * np.abs(expected).max())
+
+
+@pytest.mark.parametrize("fields", ["E", "M", "G"])
+def test_tree_converges_to_the_pair_sum_as_theta_shrinks(fields):
+    particles = cloud(200)
+    expected = pairwise_acceleration(particles, fields)
+    errors = [relative_error(solver_acceleration(particles, fields, Barnes_Hut_Solver(theta)), expected)
+              for theta in (0.5, 0.3, 0.0)]
+    assert errors[0] < 1e-2
+    assert errors[1] < errors[0]
+    assert errors[2] < 1e-12
+
+
+@pytest.mark.parametrize("fields", ["E", "M", "G"])
+def test_mesh_follows_the_pair_sum_and_improves_with_the_grid(fields):
+    # Close pairs are smoothed out by the grid, so compare the typical particle rather than the total
+    particles = cloud(200)
+    expected = pairwise_acceleration(particles, fields)
+    errors = []
+    for grid_size in (32, 64):
+        acc = solver_acceleration(particles, fields, Particle_Mesh_Solver(grid_size))
+        errors.append(np.median(np.linalg.norm(acc - expected, axis=1) / np.linalg.norm(expected, axis=1)))
+    assert errors[0] < 0.1
+    assert errors[1] < errors[0] / 2
+
+
+@pytest.mark.parametrize("group_class", [Particle_Group, Vectorised_Particle_Group])
+@pytest.mark.parametrize("E, M, G", [(e, m, g) for e in (False, True) for m in (False, True) for g in (False, True)])
+def test_fused_kernel_matches_the_separate_field_updates(group_class, E, M, G):
+    fields = "E" * E + "M" * M + "G" * G
+    particles = cloud(30, tests=5)
+    expected = pairwise_acceleration(particles, fields)
+    group = group_class(particles)
+    group.resetAccelerations()
+    group.interaction_kernel(E, M, G)()
+    np.testing.assert_allclose(group.state_arrays()[2], expected, rtol=1e-9, atol=1e-12 * np.abs(expected).max())
+
+
+def test_parallel_solver_matches_the_pair_sum():
+    # Several tiles per worker, with test particles in the last tile
+    particles = cloud(70, tests=6)
+    solver = Parallel_Pair_Solver(processes=2, tile_size=16)
+    try:
+        acc = solver_acceleration(particles, "EMG", solver)
+        # The pool and shared memory are reused while the particle count stays the same
+        pool = solver._pool
+        assert np.array_equal(solver_acceleration(particles, "EMG", solver), acc)
+        assert solver._pool is pool
+    finally:
+        solver.close()
+    expected = pairwise_acceleration(particles, "EMG")
+    np.testing.assert_allclose(acc, expected, rtol=1e-9, atol=1e-12 * np.abs(expected).max())
+
+
+def truncated_coulomb(particles, pos, cutoff):
+    """Brute-force Coulomb accelerations from the pairs closer than cutoff"""
+    charge = np.array([p.charge for p in particles])
+    mass = np.array([p.mass for p in particles])
+    source = ~np.array([p.is_test_particle for p in particles])
+    d = pos[np.newaxis, :, :] - pos[:, np.newaxis, :]
+    r = np.sqrt(np.einsum("ijk,ijk->ij", d, d)) + 1e-9
+    weight = np.where((r <= cutoff) & ~np.eye(len(pos), dtype=bool), charge * source, 0.0)
+    return -(COULOMB_K * charge / mass)[:, np.newaxis] * np.einsum("ijk,ij->ik", d, weight / r**3)
+
+
+@pytest.mark.parametrize("group_class", [Particle_Group, Vectorised_Particle_Group])
+def test_cutoff_keeps_only_the_pairs_inside_it_as_particles_move(group_class):
+    particles = cloud(80, seed=4, tests=8)
+    rng = np.random.default_rng(5)
+    group = group_class(particles)
+    group.set_cutoff(0.4, skin=0.1)
+    kernel = group.interaction_kernel(True, False, False)
+    for _ in range(20):
+        pos = group.positions() + rng.normal(0, 0.01, (len(particles), 3))
+        group.set_motion(pos, group.velocities())
+        group._precompute_pair_data()
+        group.resetAccelerations()
+        kernel()
+        expected = truncated_coulomb(particles, pos, 0.4)
+        np.testing.assert_allclose(group.state_arrays()[2], expected, rtol=1e-9, atol=1e-12 * np.abs(expected).max())
+    # The list is only rebuilt once some particle has moved half the skin
+    assert 1 < group.neighbour_list.version < 20
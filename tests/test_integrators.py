@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from vpython import vector
+
+from Particle_manager import Particle, SimulationState, Vectorised_Particle_Group, COULOMB_K
+from Integrator_manager import make_integrator
+
+# Charge giving k q^2 = 1, so a pair of opposite charges a unit distance apart attract with unit force
+Q = (1 / COULOMB_K) ** 0.5
+
+
+def orbiting_pair():
+    return [Particle(Q, 1.0, vector(-0.5, 0, 0), vector(0, -0.6, 0.1), vector(0, 0, 0), 0.01, vector(1, 0, 0)),
+            Particle(-Q, 1.0, vector(0.5, 0, 0), vector(0, 0.6, -0.1), vector(0, 0, 0), 0.01, vector(0, 0, 1))]
+
+
+def tight_binary_and_bystander():
+    v = (1 / 0.2) ** 0.5  # Circular orbit for the pair 0.1 apart
+    return [Particle(Q, 1.0, vector(-0.05, 0, 0), vector(0, -v, 0), vector(0, 0, 0), 0.01, vector(1, 0, 0)),
+            Particle(-Q, 1.0, vector(0.05, 0, 0), vector(0, v, 0), vector(0, 0, 0), 0.01, vector(0, 0, 1)),
+            Particle(0.01 * Q, 1.0, vector(5, 0, 0), vector(0, 0.01, 0), vector(0, 0, 0), 0.01, vector(0, 1, 0))]
+
+
+def integrate(name, dt, duration=1.0, particles=orbiting_pair):
+    group = Vectorised_Particle_Group(particles())
+    kernel = group.interaction_kernel(True, False, False)
+
+    def evaluate(targets=None):
+        if targets is None:
+            group.resetAccelerations()
+            kernel()
+        else:
+            group.acc[targets] = 0.0
+            kernel(targets)
+
+    integrator = make_integrator(name)
+    acc_ready = False
+    for _ in range(round(duration / dt)):
+        if not acc_ready:
+            evaluate()
+        acc_ready = integrator.step(group, dt, evaluate)
+    return group.pos.copy()
+
+
+@pytest.mark.parametrize("name, order", [("euler", 1), ("verlet", 2), ("rk4", 4)])
+def test_convergence_order(name, order):
+    reference = integrate("rk4", 1e-4)
+    errors = [np.abs(integrate(name, dt) - reference).max() for dt in (0.02, 0.01)]
+    assert np.log2(errors[0] / errors[1]) == pytest.approx(order, abs=0.3)
+
+
+def test_block_time_steps_follow_the_orbit():
+    reference = integrate("rk4", 1e-4)
+    assert np.abs(integrate("block", 0.01) - reference).max() < 1e-4
+
+
+def test_block_time_steps_refine_only_the_close_pair():
+    reference = integrate("rk4", 1e-5, 0.28, tight_binary_and_bystander)
+    group = Vectorised_Particle_Group(tight_binary_and_bystander())
+    group.interaction_kernel(True, False, False)()
+    levels = make_integrator("block")._levels(group, group.acc, 0.02)
+    assert levels[0] == levels[1] > levels[2]
+    # A single frame step of 0.02 is too long for the pair's orbit, but not for its own steps
+    assert np.abs(integrate("verlet", 0.02, 0.28, tight_binary_and_bystander) - reference).max() > 1e-2
+    assert np.abs(integrate("block", 0.02, 0.28, tight_binary_and_bystander) - reference).max() < 1e-3
+
+
+def test_boris_rotation_keeps_speeds_in_a_magnetic_field():
+    particles = [Particle(1.0, 1.0, vector(0, 0, 0), vector(3e3, 0, 0), vector(0, 0, 0), 0.01, vector(1, 0, 0)),
+                 Particle(1.0, 1.0, vector(0, 1, 0), vector(4e3, 0, 0), vector(0, 0, 0), 0.01, vector(0, 0, 1))]
+    group = Vectorised_Particle_Group(particles)
+    speeds = np.linalg.norm(group.vel, axis=1)
+    integrator = make_integrator("boris")
+    for _ in range(100):
+        integrator.step(group, 1e-3, None)
+    assert not np.allclose(group.vel[:, 1], 0.0)
+    np.testing.assert_allclose(np.linalg.norm(group.vel, axis=1), speeds, rtol=1e-12)
+
+
+def field_acceleration(particles, pos, vel, fields):
+    group = Vectorised_Particle_Group(particles)
+    group.pos[:] = pos
+    group.vel[:] = vel
+    group.resetAccelerations()
+    group.interaction_kernel(*fields)()
+    return group.acc
+
+
+@pytest.mark.parametrize("name", ["euler", "verlet", "rk4", "boris", "block"])
+@pytest.mark.parametrize("fields", [(True, False, True), (False, True, False)])
+def test_recorded_acceleration_is_the_field_at_the_recorded_state(headless, name, fields):
+    particles = [Particle(Q * (-1) ** i, 1.0, vector(i, 0.3 * i, 0), vector(0.2 * i, 1e3 * (i - 1), 0),
+                          vector(0, 0, 0), 0.01, vector(1, 0, 0)) for i in range(3)]
+    store = SimulationState(particles)
+    store.build("orbit", 10, 1e-3, 0.05, name)
+    E, M, G = fields
+    headless.Sim(store, E=E, M=M, G=G, vectorised=True).pre_compute()
+
+    pos, vel, acc = (store.channel(channel) for channel in ("pos", "vel", "acc"))
+    assert pos.frames == vel.frames == acc.frames
+    for f in (0, 1, pos.frames // 2, pos.frames - 1):
+        expected = field_acceleration(particles, pos.frame(f), vel.frame(f), fields)
+        np.testing.assert_allclose(acc.frame(f), expected, rtol=1e-9, atol=1e-12 * np.abs(expected).max())
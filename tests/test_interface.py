@@ -0,0 +1,26 @@
+import Interface_manager
+from test_simulation import make_store
+
+
+def test_new_simulation_asks_for_the_time_step(headless, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    answers = iter(["run", "", "20", "0.5", "n", "n", "n", "verlet", "-1", "0.001", "1", "n", "n"])
+    monkeypatch.setattr("builtins.input", lambda msg="": next(answers))
+    runs = []
+
+    class Recorder:
+        def __init__(self, store, **kwargs):
+            runs.append(store)
+
+        def start_stream(self):
+            pass
+
+        def Run(self):
+            pass
+
+    monkeypatch.setattr(Interface_manager, "Sim", Recorder)
+    interface = Interface_manager.Interface_manager()
+    monkeypatch.setattr(interface, "par_desc_inp", lambda: make_store().particles)
+    interface.new_simulation()
+
+    assert (runs[0].sim_increment, runs[0].integrator, runs[0].sim_duration) == (0.001, "verlet", 0.5)
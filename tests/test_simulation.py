@@ -0,0 +1,203 @@
+from copy import deepcopy
+
+import numpy as np
+import pytest
+from vpython import vector
+
+from Particle_manager import Particle, SimulationState, COULOMB_K
+from Octree_manager import Barnes_Hut_Solver
+from Mesh_manager import Particle_Mesh_Solver
+
+Q = (1 / COULOMB_K) ** 0.5
+
+
+def make_store(n=4, increment=1e-3, duration=0.2, integrator="euler", speed=0.3, extra=(), **kwargs):
+    particles = [Particle(Q * (-1) ** i, 1.0 + i, vector(i, 0.4 * i * (-1) ** i, 0), vector(0.1, speed * i, 0.05 * i),
+                          vector(0, 0, 0), 0.01, vector(1, 0, 0)) for i in range(n)] + list(extra)
+    store = SimulationState(particles, **kwargs)
+    store.build("run", 10, increment, duration, integrator)
+    return store
+
+
+def channels(store):
+    return [store.channel(name).block(0, store.channel(name).frames).copy() for name in ("pos", "vel", "acc")]
+
+
+@pytest.mark.parametrize("integrator", ["euler", "verlet", "boris"])
+def test_output_stride_keeps_every_kth_frame(headless, integrator):
+    every_step = make_store(integrator=integrator)
+    headless.Sim(every_step).pre_compute()
+    strided = make_store(integrator=integrator)
+    headless.Sim(strided, output_stride=5, aggregates=True).pre_compute()
+
+    for full, kept in zip(channels(every_step), channels(strided)):
+        np.testing.assert_allclose(kept, full[::5], rtol=1e-12, atol=1e-15)
+
+    # Frame f aggregates the steps since frame f - 1
+    for channel, full in zip(("pos", "vel", "acc"), channels(every_step)):
+        stats = strided.aggregates[channel]
+        frames = stats["mean"].frames
+        windows = full[1:5 * frames + 1].reshape(frames, 5, *full.shape[1:])
+        np.testing.assert_allclose(stats["min"].block(0, frames), windows.min(axis=1), rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(stats["max"].block(0, frames), windows.max(axis=1), rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(stats["mean"].block(0, frames), windows.mean(axis=1), rtol=1e-9, atol=1e-15)
+
+
+@pytest.mark.parametrize("integrator, vectorised", [("euler", False), ("euler", True), ("verlet", True), ("boris", True)])
+def test_frames_replayed_from_checkpoints_match_the_recorded_run(headless, integrator, vectorised):
+    recorded = make_store(integrator=integrator)
+    headless.Sim(recorded, vectorised=vectorised, output_stride=2).pre_compute()
+    expected = channels(recorded)
+
+    store = make_store(integrator=integrator)
+    store.set_checkpoints(7, keep_frames=False)
+    sim = headless.Sim(store, vectorised=vectorised, output_stride=2)
+    sim.pre_compute()
+    assert store.recorded_frames == len(expected[0])
+    # Forwards, as playback does, then seeking back to the last frame of each checkpoint interval
+    for frame in list(range(store.recorded_frames)) + [20, 13, 6, store.recorded_frames - 1]:
+        for replayed, full in zip(sim._frame_arrays(frame), expected):
+            np.testing.assert_allclose(replayed, full[frame], rtol=1e-12, atol=1e-15)
+
+
+def test_runs_without_kept_frames_refuse_direct_reads(headless):
+    from Analysis_manager import Analysis_manager
+    from Database_manager import File_Manager
+    store = make_store()
+    store.set_checkpoints(10, keep_frames=False)
+    headless.Sim(store).pre_compute()
+    with pytest.raises(ValueError, match="checkpoints"):
+        Analysis_manager(store).process_data("Speed")
+    with pytest.raises(ValueError, match="checkpoints"):
+        File_Manager()._ds_to_JSON_D(store)
+
+
+def test_pre_compute_resumes_from_the_latest_checkpoint(headless):
+    complete = make_store()
+    headless.Sim(complete).pre_compute()
+
+    store = make_store()
+    store.set_checkpoints(10)
+    sim = headless.Sim(store)
+    sim.run_time = 0.125  # Interrupted part-way through
+    sim.pre_compute()
+    sim.run_time = 0.2
+    sim.pre_compute(resume=True)
+    for resumed, full in zip(channels(store), channels(complete)):
+        np.testing.assert_array_equal(resumed, full)
+
+
+@pytest.mark.parametrize("integrator", ["euler", "verlet", "rk4", "boris", "block"])
+@pytest.mark.parametrize("fields", [(True, False, True), (False, True, False)])
+def test_primary_profile_derives_the_stored_accelerations(headless, integrator, fields):
+    E, M, G = fields
+    # Fast enough for the magnetic forces to stand out from rounding
+    full = make_store(integrator=integrator, speed=2e3)
+    headless.Sim(full, E=E, M=M, G=G, vectorised=True).pre_compute()
+    primary = make_store(integrator=integrator, speed=2e3, profile="primary")
+    headless.Sim(primary, E=E, M=M, G=G, vectorised=True).pre_compute()
+
+    stored, derived = full.channel("acc"), primary.channel("acc")
+    assert derived.frames == stored.frames
+    scale = np.abs(stored.block(0, stored.frames)).max()
+    np.testing.assert_allclose(derived.block(0, derived.frames), stored.block(0, stored.frames),
+                               rtol=1e-9, atol=1e-12 * scale)
+    for f in (0, 63, 64, stored.frames - 1):
+        np.testing.assert_allclose(derived.frame(f), stored.frame(f), rtol=1e-9, atol=1e-12 * scale)
+
+
+@pytest.mark.parametrize("settings", [lambda: {"solver": Barnes_Hut_Solver(0.9, leaf_size=1)},
+                                      lambda: {"solver": Particle_Mesh_Solver(16)}, lambda: {"cutoff": 1.5},
+                                      lambda: {"cutoff": 1.5, "vectorised": True}])
+def test_primary_profile_derives_with_the_run_solver_and_cutoff(headless, settings):
+    full = make_store(n=8, integrator="verlet", duration=0.05)
+    headless.Sim(full, **settings()).pre_compute()
+    primary = make_store(n=8, integrator="verlet", duration=0.05, profile="primary")
+    headless.Sim(primary, **settings()).pre_compute()
+
+    stored = full.channel("acc").block(0, full.recorded_frames)
+    derived = primary.channel("acc").block(0, primary.recorded_frames)
+    np.testing.assert_allclose(derived, stored, rtol=1e-9, atol=1e-12 * np.abs(stored).max())
+
+
+def test_streamed_run_matches_a_blocking_run(headless):
+    blocking = make_store()
+    headless.Sim(blocking).pre_compute()
+
+    streamed = make_store()
+    sim = headless.Sim(streamed)
+    sim.start_stream()
+    sim.finish_stream()
+    assert sim._playable_frames() == sim.frames_left
+    for a, b in zip(channels(streamed), channels(blocking)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_changes_in_the_window_do_not_reach_a_running_stream(headless):
+    from types import SimpleNamespace
+    blocking = make_store(duration=1.0)
+    headless.Sim(blocking).pre_compute()
+
+    streamed = make_store(duration=1.0)
+    sim = headless.Sim(streamed)
+    sim.start_stream()
+    sliders = sim.sliders[0]
+    sliders["mass_slider"].value = 9.0
+    sim.set_mass(sliders["mass_slider"], sim.particles.array_particles[0])
+    sliders["charge_slider"].value = -9.0
+    sim.set_charge(sliders["charge_slider"], sim.particles.array_particles[0])
+    sim.toggle_electric_field(SimpleNamespace(checked=False))
+    sim.finish_stream()
+    for a, b in zip(channels(streamed), channels(blocking)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_stop_stream_cancels_the_producer(headless):
+    store = make_store(duration=100.0)
+    sim = headless.Sim(store)
+    sim.start_stream()
+    sim.stop_stream()
+    assert not sim._producer.is_alive()
+    assert store.recorded_frames < sim.frames_left
+
+
+@pytest.mark.parametrize("vectorised", [False, True])
+def test_test_particles_feel_the_fields_without_acting_back(headless, vectorised):
+    sources_only = make_store()
+    headless.Sim(sources_only, vectorised=vectorised).pre_compute()
+
+    probes = [Particle(Q * s, 0.5, vector(0.5, -0.5 * s, 0.3), vector(0, 0.2, 0), vector(0, 0, 0), 0.01,
+                       vector(0, 1, 0), True) for s in (1, -1)]
+    with_tests = make_store(extra=deepcopy(probes))
+    headless.Sim(with_tests, vectorised=vectorised).pre_compute()
+
+    n = len(sources_only.particles)
+    for expected, actual in zip(channels(sources_only), channels(with_tests)):
+        np.testing.assert_allclose(actual[:, :n], expected, rtol=1e-12, atol=1e-15)
+    # Each probe is pushed by the sources, and the two probes don't see each other
+    pos = channels(with_tests)[0]
+    assert not np.allclose(pos[-1, n:], pos[0, n:] + 0.2 * np.array([0, 0.2, 0]))
+    acc = channels(with_tests)[2]
+    probe_alone = make_store(extra=probes[:1])
+    headless.Sim(probe_alone, vectorised=vectorised).pre_compute()
+    np.testing.assert_allclose(channels(probe_alone)[2][:, n], acc[:, n], rtol=1e-9, atol=1e-12)
+
+
+def test_interpolated_playback_follows_the_skipped_steps(headless):
+    dense = make_store(duration=0.4, integrator="verlet", speed=2.0)
+    headless.Sim(dense, vectorised=True).pre_compute()
+    sparse = make_store(duration=0.4, integrator="verlet", speed=2.0)
+    sim = headless.Sim(sparse, vectorised=True, output_stride=8)
+    sim.pre_compute()
+    assert sim.substeps == 8
+
+    pos = channels(dense)[0]
+    hermite_error = linear_error = 0.0
+    for frame in range(sparse.recorded_frames - 1):
+        for sub in range(8):
+            expected = pos[8 * frame + sub]
+            interpolated = np.array([[v.x, v.y, v.z] for v in sim._interpolated_positions(frame, sub / 8)])
+            linear = (1 - sub / 8) * pos[8 * frame] + sub / 8 * pos[8 * frame + 8]
+            hermite_error = max(hermite_error, np.abs(interpolated - expected).max())
+            linear_error = max(linear_error, np.abs(linear - expected).max())
+    assert hermite_error < linear_error / 1000
@@ -0,0 +1,120 @@
+import gc
+import os
+from copy import deepcopy
+
+import numpy as np
+import pytest
+from vpython import vector
+
+from Database_manager import File_Manager
+from Storage_manager import (Trajectory, Trajectory_View, Mapped_Trajectory, Storage_Directory, encode_trajectory,
+                             decode_payload)
+from test_simulation import make_store, channels
+
+
+def test_trajectory_views_behave_like_the_lists_of_vectors_they_replace():
+    rng = np.random.default_rng(0)
+    lists = [[vector(*rng.normal(size=3)) for _ in range(frames)] for frames in (5, 3, 5)]
+    trajectory = Trajectory(3, expected_frames=2)
+    trajectory.load(lists)
+    view = Trajectory_View(trajectory)
+
+    assert len(view) == 3 and [len(particle) for particle in view] == [5, 3, 5]
+    assert view[1][-1] == lists[1][-1] and view[-1][2] == lists[2][2]
+    assert view[0][1:3] == lists[0][1:3]
+    assert view.tolist() == [[[v.x, v.y, v.z] for v in values] for values in lists]
+    with pytest.raises(IndexError):
+        view[1][3]
+
+    # Appending grows the array past its preallocated frames without losing any
+    extra = vector(1, 2, 3)
+    view[1].append(extra)
+    lists[1].append(extra)
+    for _ in range(4):
+        trajectory.append_frame(np.ones((3, 3)))
+        for values in lists:
+            values.append(vector(1, 1, 1))
+    assert [list(particle) for particle in view] == lists
+    assert len(trajectory.data) > 5
+    np.testing.assert_array_equal(trajectory.frame(4), [[v.x, v.y, v.z] for v in (values[4] for values in lists)])
+    np.testing.assert_array_equal(trajectory.particle(1), [[v.x, v.y, v.z] for v in lists[1]])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_memmap_runs_match_in_memory_runs(headless, dtype):
+    in_memory = make_store(dtype=dtype)
+    headless.Sim(in_memory).pre_compute()
+    mapped = make_store(dtype=dtype, storage="memmap")
+    headless.Sim(mapped).pre_compute()
+
+    assert all(isinstance(trajectory, Mapped_Trajectory) for trajectory in mapped.trajectories.values())
+    for expected, actual in zip(channels(in_memory), channels(mapped)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_temporary_storage_directory_is_removed_with_the_store(headless):
+    store = make_store(storage="memmap")
+    headless.Sim(store).pre_compute()
+    path = os.fspath(store.storage_dir)
+    assert os.listdir(path)
+    assert deepcopy(store).storage_dir is store.storage_dir
+
+    del store
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_storage_directory_outlives_the_trajectories_mapped_in_it():
+    directory = Storage_Directory()
+    path = directory.path
+    trajectory = Mapped_Trajectory(2, directory, expected_frames=4)
+    trajectory.append_frame(np.ones((2, 3)))
+    del directory
+    gc.collect()
+    assert os.path.exists(trajectory.path)
+
+    del trajectory
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def random_walk(frames=2000, n=3, seed=0):
+    rng = np.random.default_rng(seed)
+    trajectory = Trajectory(n)
+    trajectory.load(1e3 + np.cumsum(rng.normal(0, 1e-2, (frames, n, 3)), axis=0).transpose(1, 0, 2))
+    return trajectory
+
+
+def decoded(trajectory, encoding, error_bound=None):
+    return np.stack([decode_payload(payload) for payload in encode_trajectory(trajectory, encoding, error_bound)], axis=1)
+
+
+def test_encodings_stay_within_their_error_bounds():
+    trajectory = random_walk()
+    data = trajectory.block(0, trajectory.frames)
+    steps = np.abs(np.diff(data, axis=0)).max()
+
+    np.testing.assert_allclose(decoded(trajectory, "float32"), data, rtol=2 ** -24, atol=0)
+    # Delta rounding errors are relative to the steps between frames and don't add up over the run
+    assert np.abs(decoded(trajectory, "delta") - data).max() <= steps * 2 ** -23
+    for error_bound in (1e-3, 1e-6):
+        assert np.abs(decoded(trajectory, "quantized", error_bound) - data).max() <= error_bound * (1 + 1e-6)
+    with pytest.raises(ValueError):
+        encode_trajectory(trajectory, "quantized")
+
+
+@pytest.mark.parametrize("encoding, error_bound", [("float64", None), ("float32", None), ("delta", None),
+                                                   ("quantized", 1e-9)])
+def test_exported_files_load_back_within_the_error_bound(headless, tmp_path, encoding, error_bound):
+    store = make_store()
+    headless.Sim(store).pre_compute()
+    store.set_encoding(encoding, error_bound)
+    File_Manager().export_file(tmp_path / "run.json", store)
+    loaded = File_Manager().import_file(tmp_path / "run.json")
+
+    tolerance = {"float64": 0, "float32": 2 ** -24, "delta": 2 ** -23}.get(encoding)
+    for expected, actual in zip(channels(store), channels(loaded)):
+        if encoding == "quantized":
+            assert np.abs(actual - expected).max() <= error_bound * (1 + 1e-6)
+        else:
+            np.testing.assert_allclose(actual, expected, rtol=tolerance, atol=tolerance * np.abs(expected).max())